@@ -22,6 +22,11 @@ python manage.py runserver 8000 &
 # Start Celery worker
 celery -A hltools worker -l info &
 
+# Start the single writer when SQLITE_SINGLE_WRITER is on
+if [ -n "$SQLITE_SINGLE_WRITER" ]; then
+    celery -A hltools worker -l info -Q "${SQLITE_WRITER_QUEUE:-sqlite-writer}" -c 1 -n writer@%h &
+fi
+
 # Start Celery beat
 celery -A hltools beat -l info --scheduler django_celery_beat.schedulers:DatabaseScheduler &
 
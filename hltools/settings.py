@@ -83,7 +83,22 @@ WSGI_APPLICATION = 'hltools.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-if 'CAPROVER' in os.environ:
+if os.environ.get('POSTGRES_DB'):
+    # PostgreSQL: no single writer lock shared by the web process, Celery and django_q
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Keep connections open between requests and tasks, checking them before reuse
+            'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+elif 'CAPROVER' in os.environ:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
@@ -153,6 +168,27 @@ REDIS_PORT = "6379"
 CELERY_REDIS_DB = os.environ.get("CELERY_REDIS_DB", "0")  # Default to 0 if not set
 CELERY_BROKER_URL = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/{CELERY_REDIS_DB}"
 
+# Redis holding the API rate-limit buckets shared by all processes; without it each process
+# falls back to its own in-memory bucket
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", CELERY_BROKER_URL if 'CAPROVER' in os.environ else None)
+
+# Seconds the AC id -> primary key maps of custom fields, pipelines and stages are kept in
+# Django's cache between sync runs; 0 loads them from the database at the start of each run
+SYNC_REFERENCE_IDS_CACHE_TIMEOUT = int(os.environ.get("SYNC_REFERENCE_IDS_CACHE_TIMEOUT", 0))
+
+# How the ingest writes a page: 'orm' (bulk_create/bulk_update) or 'copy', which on PostgreSQL
+# COPYs the page into temp tables and merges it with one statement per table
+SYNC_BULK_LOAD = os.environ.get("SYNC_BULK_LOAD", "orm")
+
+# How the contacts' raw AC payloads are stored: 'zlib' (compressed) or 'none' (compact JSON)
+SYNC_PAYLOAD_COMPRESSION = os.environ.get("SYNC_PAYLOAD_COMPRESSION", "zlib")
+
+# SQLite single writer: push workers send their row updates (hl_ids, sync hashes, outbox and
+# log updates) as one batch per chunk to SQLITE_WRITER_QUEUE, which a single worker serves:
+#   celery -A hltools worker -Q sqlite-writer -c 1
+SQLITE_SINGLE_WRITER = os.environ.get("SQLITE_SINGLE_WRITER", "").lower() in ("1", "true", "yes")
+SQLITE_WRITER_QUEUE = os.environ.get("SQLITE_WRITER_QUEUE", "sqlite-writer")
+
 # Celery Configuration
 CELERY_RESULT_BACKEND = "django-db"
 CELERY_CACHE_BACKEND = "django-cache"
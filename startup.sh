@@ -20,6 +20,9 @@ if [ "$APP_ENV" = 'web' ]; then
     gunicorn --bind=0.0.0.0:80 --timeout 600 --workers=1 --chdir hltools hltools.wsgi --access-logfile '-' --error-logfile '-'
 elif [ "$APP_ENV" = 'worker' ]; then
     celery -A hltools worker -l info 
+elif [ "$APP_ENV" = 'writer' ]; then
+    # Single writer for SQLITE_SINGLE_WRITER; must run with concurrency 1
+    celery -A hltools worker -l info -Q "${SQLITE_WRITER_QUEUE:-sqlite-writer}" -c 1
 elif [ "$APP_ENV" = 'beat' ]; then
     celery -A hltools beat -l info --scheduler django_celery_beat.schedulers:DatabaseScheduler
 fi
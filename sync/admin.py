@@ -18,12 +18,14 @@ def run_sync_script(modeladmin, request, queryset):
 # Add this action to any of your model admins, for example:
 @admin.register(SyncLog)
 class SyncLogAdmin(admin.ModelAdmin):
-    list_display = ['start_time', 'end_time', 'contacts_attempted', 'contacts_synced', 'status']
+    list_display = ['start_time', 'end_time', 'sync_type', 'contacts_attempted', 'contacts_changed', 'contacts_skipped', 'contacts_ingest_failed', 'contacts_synced', 'contacts_failed', 'deals_synced', 'deals_failed', 'status']
     
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
             path('run-sync-script/', self.admin_site.admin_view(self.run_sync_script_view), name='run-sync-script'),
+            path('run-full-sync-script/', self.admin_site.admin_view(self.run_full_sync_script_view), name='run-full-sync-script'),
+            path('resume-sync-script/', self.admin_site.admin_view(self.resume_sync_script_view), name='resume-sync-script'),
         ]
         return custom_urls + urls
     
@@ -32,6 +34,18 @@ class SyncLogAdmin(admin.ModelAdmin):
         task = run.delay()
         messages.success(request, f"Sync script scheduled (Task ID: {task.id})")
         return redirect('admin:sync_synclog_changelist')
+
+    def run_full_sync_script_view(self, request):
+        # Schedule a sync that ignores the delta watermark
+        task = run.delay(full=True)
+        messages.success(request, f"Full sync scheduled (Task ID: {task.id})")
+        return redirect('admin:sync_synclog_changelist')
+
+    def resume_sync_script_view(self, request):
+        # Continue the latest failed or interrupted sync from its checkpoint
+        task = run.delay(resume=True)
+        messages.success(request, f"Sync resume scheduled (Task ID: {task.id})")
+        return redirect('admin:sync_synclog_changelist')
     
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
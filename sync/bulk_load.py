@@ -0,0 +1,76 @@
+import itertools
+import json
+
+from django.conf import settings
+from django.db import connection, models
+
+# Suffixes keeping temp table names unique within a transaction
+_temp_table_ids = itertools.count(1)
+
+
+def use_copy_load():
+    """Whether the ingest should load pages with COPY (SYNC_BULK_LOAD='copy' on PostgreSQL)"""
+    return getattr(settings, 'SYNC_BULK_LOAD', 'orm') == 'copy' and connection.vendor == 'postgresql'
+
+
+def _copy_value(field, value):
+    if value is None:
+        return None
+    if isinstance(field, models.JSONField):
+        # COPY takes the JSON text; the ORM's Jsonb wrapper is only for query parameters
+        return json.dumps(value, cls=field.encoder)
+    return field.get_db_prep_save(value, connection)
+
+
+def stage_rows(model, objs, field_names):
+    """
+    COPY the given fields of `objs` (unsaved model instances) into a temp table shaped like
+    the model's table, dropped at the end of the transaction. Returns (temp table, columns).
+    """
+    fields = [model._meta.get_field(name) for name in field_names]
+    columns = [field.column for field in fields]
+    quote = connection.ops.quote_name
+    table = quote(f"{model._meta.db_table}_load_{next(_temp_table_ids)}")
+    column_list = ', '.join(quote(column) for column in columns)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMP TABLE {table} ON COMMIT DROP AS "
+            f"SELECT {column_list} FROM {quote(model._meta.db_table)} WITH NO DATA"
+        )
+        with cursor.cursor.copy(f"COPY {table} ({column_list}) FROM STDIN") as copy:
+            for obj in objs:
+                copy.write_row([_copy_value(field, getattr(obj, field.attname)) for field in fields])
+    return table, columns
+
+
+def copy_upsert(model, objs, unique_fields, update_fields):
+    """
+    Insert or update `objs` like bulk_create(update_conflicts=True), staging them with COPY
+    and merging with a single INSERT ... ON CONFLICT. Must run inside a transaction.
+    """
+    objs = list(objs)
+    if not objs:
+        return
+    quote = connection.ops.quote_name
+    table, columns = stage_rows(model, objs, unique_fields + update_fields)
+    column_list = ', '.join(quote(column) for column in columns)
+    conflict = ', '.join(quote(model._meta.get_field(name).column) for name in unique_fields)
+    updates = ', '.join(
+        f"{quote(column)} = EXCLUDED.{quote(column)}"
+        for column in (model._meta.get_field(name).column for name in update_fields)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(model._meta.db_table)} ({column_list}) SELECT {column_list} FROM {table} "
+            f"ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+        )
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields):
+    """bulk_create(update_conflicts=True), or copy_upsert when the COPY bulk-load mode is on"""
+    if use_copy_load():
+        copy_upsert(model, objs, unique_fields, update_fields)
+    else:
+        model.objects.bulk_create(objs, update_conflicts=True, unique_fields=unique_fields, update_fields=update_fields)
+
@@ -1,28 +1,200 @@
 import os
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+from dataclasses import dataclass, asdict
 import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, stop_after_attempt, wait_exponential, before_sleep_log
+from urllib3.exceptions import NewConnectionError
 from dotenv import load_dotenv
 from django.conf import settings
-from .models import Contact, ContactCustomField, CustomField, SyncLog
+from django.db import transaction
+from django.db.models import F
+from .models import (
+    Contact, ContactCustomField, CustomField, Deal, DealStage, HighLevelOutbox, HLContact, HLDealstage, HLPipeline, PipeLine, SyncLog
+)
+from .rate_limit import SharedRateLimiter, account_key, get_retry_after
+from .write_queue import WriteBuffer, single_writer_enabled
 from django.utils import timezone
 from tqdm import tqdm
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Load HighLevel API key from environment variable or settings
 HL_API_KEY = os.environ['HIGHLEVEL_API_KEY']
 
 # HighLevel API base URL
-HL_BASE_URL = 'https://rest.gohighlevel.com/v1'
+HL_BASE_URL = os.environ.get('HIGHLEVEL_BASE_URL', 'https://rest.gohighlevel.com/v1')
+
+# Maximum request rate for the HighLevel account, shared by all processes
+HL_REQUESTS_PER_SECOND = float(os.environ.get('HIGHLEVEL_REQUESTS_PER_SECOND', 10))
+HL_MAX_ATTEMPTS = 5
+HL_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Requests that can be resent after any failure; others (POSTs) only when HighLevel can't have acted on them
+HL_IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# Longest wait between attempts, however long a Retry-After HighLevel sends
+HL_MAX_RETRY_WAIT = 60
+
+# AC custom field types with a direct HighLevel equivalent; the rest are created as text fields
+HL_FIELD_DATA_TYPES = {'text': 'TEXT', 'textarea': 'LARGE_TEXT', 'date': 'DATE', 'datetime': 'DATE'}
+
+# Contacts sync_all_contacts_to_highlevel loads and pushes at a time; with the single writer,
+# also the contacts per write batch
+WRITE_BATCH_SIZE = 100
+
+# How long a process trusts its CustomField -> HighLevel id map before reloading it
+CUSTOM_FIELD_MAP_TTL = 300
+
+# AC deal status codes and the HighLevel opportunity statuses they map to
+AC_DEAL_STATUSES = {'0': 'open', '1': 'won', '2': 'lost'}
+
+# Re-import the HighLevel contact directory once it is older than this
+HL_DIRECTORY_MAX_AGE = timedelta(hours=float(os.environ.get('HIGHLEVEL_DIRECTORY_MAX_AGE_HOURS', 24)))
+
+
+class HighLevelRetryableError(Exception):
+    """Raised for responses worth retrying (429 and 5xx)"""
+
+    def __init__(self, response):
+        super().__init__(f"HighLevel responded with {response.status_code}")
+        self.response = response
+
+
+def wait_retry_after(retry_state):
+    """Honour Retry-After (up to HL_MAX_RETRY_WAIT) when HighLevel sends it, otherwise back off exponentially"""
+    exception = retry_state.outcome.exception()
+    retry_after = get_retry_after(getattr(exception, 'response', None))
+    if retry_after is not None:
+        return min(retry_after, HL_MAX_RETRY_WAIT)
+    return wait_exponential(multiplier=1, min=1, max=30)(retry_state)
+
+
+def request_not_sent(exception):
+    """Whether a requests exception was raised before the request reached the server"""
+    if isinstance(exception, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exception, requests.exceptions.ConnectionError) and exception.args:
+        # requests wraps urllib3's MaxRetryError, whose reason says where the connection failed
+        return isinstance(getattr(exception.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+def retry_if_safe(retry_state):
+    """
+    Retry idempotent requests on 429, 5xx, connection errors and timeouts.
+    Other requests could be applied twice, so they are only retried on 429 or when
+    they never reached HighLevel.
+    """
+    exception = retry_state.outcome.exception()
+    if exception is None:
+        return False
+    method = retry_state.args[1]
+    if method.upper() in HL_IDEMPOTENT_METHODS:
+        return isinstance(exception, (HighLevelRetryableError, requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    if isinstance(exception, HighLevelRetryableError):
+        return exception.response.status_code == 429
+    return request_not_sent(exception)
+
+
+@dataclass
+class SyncResult:
+    """Outcome of pushing one record to HighLevel"""
+    contact_id: int
+    action: str  # 'created', 'updated', 'skipped' or 'failed'
+    hl_id: str = None
+    status_code: int = None
+    error: str = None
+    deal_id: int = None  # set when the record is a deal
+
+    @property
+    def success(self):
+        return self.action != 'failed'
+
+    def __bool__(self):
+        return self.success
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class HighLevelClient:
+    """
+    HighLevel API client with a keep-alive connection pool, a rate limit shared with every
+    other process using the same account, and retries that honour Retry-After (see retry_if_safe).
+    Use get_client() to share one instance per worker process.
+    """
+
+    def __init__(self, api_key=None, base_url=HL_BASE_URL, requests_per_second=HL_REQUESTS_PER_SECOND,
+                 pool_size=10, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.limiter = SharedRateLimiter(f"hl:{account_key(api_key or HL_API_KEY)}", requests_per_second)
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': f'Bearer {api_key or HL_API_KEY}',
+            'Content-Type': 'application/json'
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @retry(
+        stop=stop_after_attempt(HL_MAX_ATTEMPTS),
+        wait=wait_retry_after,
+        retry=retry_if_safe,
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+        reraise=True,
+    )
+    def _send(self, method, url, **kwargs):
+        self.limiter.acquire()
+        response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        self.limiter.observe(response)
+        if response.status_code in HL_RETRY_STATUSES:
+            raise HighLevelRetryableError(response)
+        return response
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request, retrying rate-limited and server errors where it is safe to resend.
+        Returns the final response; connection errors and timeouts are raised once retries run out.
+        """
+        url = path if path.startswith('http') else f"{self.base_url}/{path.lstrip('/')}"
+        try:
+            return self._send(method, url, **kwargs)
+        except HighLevelRetryableError as e:
+            return e.response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+
+_client = None
+_client_pid = None
+
+
+def get_client():
+    """Return the HighLevel client for this process, creating it after a fork"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = HighLevelClient()
+        _client_pid = os.getpid()
+    return _client
+
 
 def check_api_connection():
     """Check if the API connection is working"""
     
-    headers = {
-        'Authorization': f'Bearer {HL_API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    url = f"{HL_BASE_URL}/locations/"
-    response = requests.get(url, headers=headers)
+    response = get_client().get('locations/')
     if response.status_code == 200:
         print("API connection successful!")
         return True
@@ -31,84 +203,464 @@ def check_api_connection():
         print(f"Response: {response.text}")
         return False
 
-def sync_contact_to_highlevel(contact):
-    """Sync a single contact to HighLevel"""
-    # Check API connection first
-    #if not check_api_connection():
-    #    return
+def normalize_field_name(name):
+    return ' '.join((name or '').split()).casefold()
 
-    headers = {
-        'Authorization': f'Bearer {HL_API_KEY}',
-        'Content-Type': 'application/json'
-    }
+def sync_highlevel_custom_fields():
+    """
+    Give every CustomField a HighLevel id.
+    HighLevel's custom field definitions are fetched once and matched by name; fields with no
+    match are created. The ids are saved in bulk to CustomField.hl_id and the in-process map
+    is refreshed. Returns the number of fields that got an id.
+    """
+    # Without a title (definitions not synced from AC yet) there is nothing to match or create by
+    unmapped = list(CustomField.objects.filter(hl_id__isnull=True).exclude(ac_title='').order_by('id'))
+    if not unmapped:
+        return 0
+
+    client = get_client()
+    response = client.get('custom-fields/')
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch HighLevel custom fields: {response.status_code} - {response.text}")
+
+    taken = set(CustomField.objects.filter(hl_id__isnull=False).values_list('hl_id', flat=True))
+    hl_ids_by_name = {}
+    for hl_field in response.json().get('customFields', []):
+        hl_ids_by_name.setdefault(normalize_field_name(hl_field.get('name')), hl_field['id'])
+
+    mapped = []
+    for custom_field in unmapped:
+        hl_id = hl_ids_by_name.get(normalize_field_name(custom_field.ac_title))
+        if hl_id is None:
+            response = client.post('custom-fields/', json={
+                'name': custom_field.ac_title,
+                'dataType': HL_FIELD_DATA_TYPES.get(custom_field.type, 'TEXT'),
+            })
+            if response.status_code not in (200, 201):
+                logger.warning(f"Failed to create HighLevel custom field {custom_field.ac_title}: {response.status_code} - {response.text}")
+                continue
+            data = response.json()
+            hl_id = data.get('customField', data)['id']
+            hl_ids_by_name[normalize_field_name(custom_field.ac_title)] = hl_id
+        if hl_id in taken:
+            # Another AC field with the same title already uses this HighLevel field
+            logger.warning(f"HighLevel custom field {hl_id} is already mapped, skipping {custom_field.ac_title} (AC {custom_field.ac_id})")
+            continue
+        taken.add(hl_id)
+        custom_field.hl_id = hl_id
+        mapped.append(custom_field)
+
+    with transaction.atomic():
+        CustomField.objects.bulk_update(mapped, ['hl_id'])
+        # Contacts already pushed went without these fields' values, so push them again
+        contact_ids = ContactCustomField.objects.filter(custom_field__in=mapped).values_list('contact_id', flat=True).distinct()
+        Contact.objects.filter(id__in=contact_ids).update(hl_synced_hash=None)
+        mark_contacts_dirty(contact_ids)
+    get_custom_field_hl_ids(reload=True)
+    return len(mapped)
+
+def mark_contacts_dirty(contact_ids):
+    """Record changed contacts in the HighLevel outbox; call inside the transaction that changed them."""
+    now = timezone.now()
+    HighLevelOutbox.objects.bulk_create(
+        [HighLevelOutbox(contact_id=contact_id, created_at=now) for contact_id in contact_ids],
+        update_conflicts=True,
+        unique_fields=['contact'],
+        update_fields=['created_at', 'processed_at'],
+    )
 
-    # Prepare contact data
+_custom_field_hl_ids = {}
+_custom_field_hl_ids_loaded_at = 0.0
+
+def get_custom_field_hl_ids(custom_field_ids=(), reload=False):
+    """
+    CustomField pk -> HighLevel id (None when unmapped), memoized for every push in this process.
+    Reloaded in one query when it is older than CUSTOM_FIELD_MAP_TTL or doesn't know one of
+    `custom_field_ids`.
+    """
+    global _custom_field_hl_ids, _custom_field_hl_ids_loaded_at
+    if (
+        reload
+        or time.monotonic() - _custom_field_hl_ids_loaded_at > CUSTOM_FIELD_MAP_TTL
+        or any(pk not in _custom_field_hl_ids for pk in custom_field_ids)
+    ):
+        _custom_field_hl_ids = dict(CustomField.objects.values_list('id', 'hl_id'))
+        _custom_field_hl_ids_loaded_at = time.monotonic()
+    return _custom_field_hl_ids
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    return email or None
+
+def record_highlevel_contacts(hl_contacts, imported_at=None):
+    """
+    Add or refresh HighLevel contacts ({'id', 'email'} dicts) in the local directory.
+    A directory import passes its start time as `imported_at`; entries recorded by pushes
+    keep the time of the import that last saw them.
+    """
+    update_fields = ['email', 'normalized_email'] + (['imported_at'] if imported_at else [])
+    imported_at = imported_at or timezone.now()
+    HLContact.objects.bulk_create(
+        [
+            HLContact(hl_id=hl_contact['id'], email=hl_contact.get('email'),
+                      normalized_email=normalize_email(hl_contact.get('email')), imported_at=imported_at)
+            for hl_contact in hl_contacts
+        ],
+        update_conflicts=True,
+        unique_fields=['hl_id'],
+        update_fields=update_fields,
+    )
+
+def import_highlevel_contacts(page_limit=100):
+    """
+    Page through every HighLevel contact once and store its id and email in the HLContact directory.
+    The import is recorded as a 'directory' SyncLog, marked Completed only after the last page.
+    Returns the number of contacts imported.
+    """
+    sync_log = SyncLog.objects.create(sync_type='directory')
+    client = get_client()
+    params = {'limit': page_limit}
+    imported = 0
+    try:
+        while True:
+            response = client.get('contacts/', params=params)
+            if response.status_code != 200:
+                raise Exception(f"Failed to list HighLevel contacts: {response.status_code} - {response.text}")
+            data = response.json()
+            hl_contacts = data.get('contacts', [])
+            record_highlevel_contacts(hl_contacts, imported_at=sync_log.start_time)
+            imported += len(hl_contacts)
+
+            meta = data.get('meta', {})
+            if not hl_contacts or not meta.get('nextPageUrl') or not meta.get('startAfterId'):
+                break
+            params = {'limit': page_limit, 'startAfterId': meta['startAfterId']}
+            if meta.get('startAfter'):
+                params['startAfter'] = meta['startAfter']
+    except Exception as e:
+        SyncLog.objects.filter(id=sync_log.id).update(
+            status='Failed', error_message=str(e), contacts_synced=imported, end_time=timezone.now()
+        )
+        raise
+
+    SyncLog.objects.filter(id=sync_log.id).update(status='Completed', contacts_synced=imported, end_time=timezone.now())
+    logger.info(f"Imported {imported} HighLevel contacts into the local directory")
+    return imported
+
+def import_highlevel_contacts_if_stale():
+    """
+    Re-import the HighLevel contact directory when no import has completed within HL_DIRECTORY_MAX_AGE.
+    Entries recorded by pushes don't count, and neither does an import that stopped part way.
+    """
+    last_import = (
+        SyncLog.objects.filter(sync_type='directory', status='Completed')
+        .order_by('-start_time').values_list('start_time', flat=True).first()
+    )
+    if last_import and timezone.now() - last_import < HL_DIRECTORY_MAX_AGE:
+        return 0
+    return import_highlevel_contacts()
+
+def resolve_hl_ids_from_directory(contacts):
+    """
+    Give contacts without an hl_id the id of the HighLevel contact with the same email, if the
+    directory has one that no other local contact uses, so they are updated instead of created.
+    Sets hl_id in memory only; it is saved with the push. Returns the number of contacts resolved.
+    """
+    emails = {}
+    for contact in contacts:
+        if not contact.hl_id and normalize_email(contact.email):
+            emails.setdefault(normalize_email(contact.email), []).append(contact)
+    if not emails:
+        return 0
+
+    hl_ids = dict(HLContact.objects.filter(normalized_email__in=emails).values_list('normalized_email', 'hl_id'))
+    taken = set(Contact.objects.filter(hl_id__in=hl_ids.values()).values_list('hl_id', flat=True)) if hl_ids else set()
+    resolved = 0
+    for email, hl_id in hl_ids.items():
+        if hl_id in taken:
+            continue
+        # Local duplicates of one email share a single HighLevel contact; the first one claims it
+        emails[email][0].hl_id = hl_id
+        taken.add(hl_id)
+        resolved += 1
+    return resolved
+
+def build_contact_payload(contact, custom_field_values):
+    """
+    HighLevel contact payload from a contact and its ContactCustomField rows.
+    Custom fields are keyed by their HighLevel id; fields without one are left out.
+    """
     contact_data = {
         'firstName': contact.first_name,
         'lastName': contact.last_name,
         'email': contact.email,
     }
 
-    # Add custom fields
-    custom_fields = {}
-    for ccf in ContactCustomField.objects.filter(contact=contact):
-        custom_field = ccf.custom_field
-        #print(ccf.custom_field)
-        #print(ccf.value)
-        custom_fields[custom_field.ac_title] = ccf.value
-    
-    
+    custom_field_values = list(custom_field_values)
+    hl_ids = get_custom_field_hl_ids({ccf.custom_field_id for ccf in custom_field_values})
+    custom_fields = {
+        hl_ids[ccf.custom_field_id]: ccf.value for ccf in custom_field_values if hl_ids[ccf.custom_field_id]
+    }
     if custom_fields:
-        contact_data['customFields'] = custom_fields
+        contact_data['customField'] = custom_fields
 
-    # Check if contact already exists in HighLevel
-    if contact.hl_id:
-        # Update existing contact
-        url = f"{HL_BASE_URL}/contacts/{contact.hl_id}"
-        response = requests.put(url, json=contact_data, headers=headers)
-    else:
-        # Create new contact
-        url = f"{HL_BASE_URL}/contacts"
-        response = requests.post(url, json=contact_data, headers=headers)
+    return contact_data
+
+def iter_id_chunks(queryset, chunk_size, limit=None):
+    """
+    Primary keys of `queryset` in ascending order, `chunk_size` at a time (the first `limit` only).
+    Each chunk is read with its own range query on the primary key, so only one chunk is held in
+    memory and rows can be updated between chunks.
+    """
+    last_id = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        chunk = queryset.order_by('pk')
+        if last_id is not None:
+            chunk = chunk.filter(pk__gt=last_id)
+        ids = list(chunk.values_list('pk', flat=True)[:chunk_size if remaining is None else min(chunk_size, remaining)])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+        if remaining is not None:
+            remaining -= len(ids)
+
+def build_highlevel_payloads(contact_ids):
+    """
+    Load a batch of contacts with their custom field values in two queries; HighLevel field
+    ids come from the memoized map.
+    Values are grouped by hand rather than prefetched: prefetched rows point back at their
+    contact, and those reference cycles keep whole batches alive until the cyclic GC runs.
+    Returns (contact, payload) pairs ready to send, in id order.
+    """
+    contacts = Contact.objects.filter(id__in=contact_ids).order_by('id')
+    custom_field_values = defaultdict(list)
+    for ccf in ContactCustomField.objects.filter(contact_id__in=contact_ids).only('contact_id', 'custom_field_id', 'value'):
+        custom_field_values[ccf.contact_id].append(ccf)
+    return [(contact, build_contact_payload(contact, custom_field_values[contact.id])) for contact in contacts]
+
+def sync_contact_to_highlevel(contact, force=False, payload=None, lookup_directory=True, writes=None):
+    """
+    Sync a single contact to HighLevel, unless it is unchanged since its last push.
+    `payload` can be passed when it was already built by build_highlevel_payloads.
+    A contact without an hl_id is matched by email against the HLContact directory and updated
+    when found; pass lookup_directory=False when resolve_hl_ids_from_directory already ran.
+    With a WriteBuffer in `writes` the database updates are recorded there instead of saved.
+    Returns a SyncResult.
+    """
+    if not force and not contact.needs_highlevel_sync():
+        return SyncResult(contact.id, 'skipped', hl_id=contact.hl_id)
+
+    if not contact.hl_id and lookup_directory:
+        resolve_hl_ids_from_directory([contact])
+
+    if payload is None:
+        payload = build_contact_payload(contact, contact.custom_field_values.all())
+
+    client = get_client()
+    try:
+        # Check if contact already exists in HighLevel
+        if contact.hl_id:
+            # Update existing contact
+            action = 'updated'
+            response = client.put(f"contacts/{contact.hl_id}", json=payload)
+        else:
+            # Create new contact
+            action = 'created'
+            response = client.post("contacts", json=payload)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Failed to sync contact: {contact.email}. {e}")
+        return SyncResult(contact.id, 'failed', hl_id=contact.hl_id, error=str(e))
 
     if response.status_code in (200, 201):
         result = response.json()
+        new_directory_entries = []
         if not contact.hl_id:
             contact.hl_id = result['contact']['id']
-            contact.save()
-        #print(f"Successfully synced contact: {contact.email}")
-    else:
-        print(f"Failed to sync contact: {contact.email}. Status code: {response.status_code}")
-        print(f"Response: {response.text}")
+            # Keep the directory current without waiting for the next import
+            new_directory_entries.append({'id': contact.hl_id, 'email': contact.email})
+        contact.hl_synced_hash = contact.content_hash
+        if writes is not None:
+            writes.update(contact, ['hl_id', 'hl_synced_hash'])
+            if new_directory_entries:
+                writes.record_highlevel_contacts(new_directory_entries)
+        else:
+            contact.save(update_fields=['hl_id', 'hl_synced_hash'])
+            if new_directory_entries:
+                record_highlevel_contacts(new_directory_entries)
+        return SyncResult(contact.id, action, hl_id=contact.hl_id, status_code=response.status_code)
+
+    if response.status_code == 404 and action == 'updated':
+        # Deleted in HighLevel since the directory import; don't match the contact to it again
+        if writes is not None:
+            writes.delete_highlevel_contact(contact.hl_id)
+        else:
+            HLContact.objects.filter(hl_id=contact.hl_id).delete()
+
+    logger.warning(f"Failed to sync contact: {contact.email}. Status code: {response.status_code}. Response: {response.text}")
+    return SyncResult(contact.id, 'failed', hl_id=contact.hl_id, status_code=response.status_code, error=response.text)
+
+def sync_highlevel_pipelines():
+    """
+    Mirror HighLevel pipelines and their stages into HLPipeline/HLDealstage with one request.
+    AC stages not linked to a HighLevel stage yet are linked when their pipeline and stage
+    names match a HighLevel stage that isn't linked to another AC stage.
+    Returns the number of AC stages newly linked.
+    """
+    response = get_client().get('pipelines/')
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch HighLevel pipelines: {response.status_code} - {response.text}")
+    hl_pipelines = response.json().get('pipelines', [])
+
+    HLPipeline.objects.bulk_create(
+        [HLPipeline(hl_id=pipeline['id'], name=pipeline['name'], hl_json=pipeline) for pipeline in hl_pipelines],
+        update_conflicts=True,
+        unique_fields=['hl_id'],
+        update_fields=['name', 'hl_json'],
+    )
+    hl_pipeline_ids = dict(HLPipeline.objects.values_list('hl_id', 'id'))
+    HLDealstage.objects.bulk_create(
+        [
+            HLDealstage(hl_id=stage['id'], name=stage['name'], hl_json=stage, hl_pipeline_id=hl_pipeline_ids[pipeline['id']])
+            for pipeline in hl_pipelines
+            for stage in pipeline.get('stages', [])
+        ],
+        update_conflicts=True,
+        unique_fields=['hl_id'],
+        update_fields=['name', 'hl_json', 'hl_pipeline'],
+    )
+
+    linked = set(DealStage.objects.filter(hl_dealstage__isnull=False).values_list('hl_dealstage_id', flat=True))
+    hl_stages = {
+        (normalize_field_name(stage.hl_pipeline.name), normalize_field_name(stage.name)): stage
+        for stage in HLDealstage.objects.select_related('hl_pipeline')
+    }
+    stages = []
+    pipelines = {}
+    for stage in DealStage.objects.filter(hl_dealstage__isnull=True, pipeline__isnull=False).select_related('pipeline'):
+        hl_stage = hl_stages.get((normalize_field_name(stage.pipeline.name), normalize_field_name(stage.name)))
+        if hl_stage is None or hl_stage.id in linked:
+            continue
+        linked.add(hl_stage.id)
+        stage.hl_dealstage = hl_stage
+        stages.append(stage)
+        if stage.pipeline.hl_pipeline_id is None:
+            stage.pipeline.hl_pipeline_id = hl_stage.hl_pipeline_id
+            pipelines[stage.pipeline.id] = stage.pipeline
+    DealStage.objects.bulk_update(stages, ['hl_dealstage'])
+    PipeLine.objects.bulk_update(pipelines.values(), ['hl_pipeline'])
+    return len(stages)
+
+def get_deals_to_push():
+    """Ids of deals changed since their last push whose stage is mapped and whose contact is in HighLevel"""
+    return (
+        Deal.objects.filter(stage__hl_dealstage__isnull=False, contact__hl_id__isnull=False)
+        .exclude(content_hash__isnull=False, hl_synced_hash=F('content_hash'))
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+def build_opportunity_payload(deal):
+    """HighLevel opportunity payload for a deal loaded with its contact and HighLevel stage"""
+    ac_deal = deal.ac_json or {}
+    payload = {
+        'title': deal.title or 'Untitled Deal',
+        'status': AC_DEAL_STATUSES.get(str(ac_deal.get('status', '0')), 'open'),
+        'stageId': deal.stage.hl_dealstage.hl_id,
+        'contactId': deal.contact.hl_id,
+    }
+    if deal.value is not None:
+        # AC deal values are in cents
+        payload['monetaryValue'] = float(deal.value) / 100
+    return payload
+
+def sync_deal_to_highlevel(deal, force=False, writes=None):
+    """
+    Push a deal as an opportunity in its mapped HighLevel pipeline, unless it is unchanged
+    since its last push. The deal must be loaded with its contact and stage__hl_dealstage__hl_pipeline.
+    With a WriteBuffer in `writes` the database update is recorded there instead of saved.
+    Returns a SyncResult.
+    """
+    if not force and not deal.needs_highlevel_sync():
+        return SyncResult(deal.contact_id, 'skipped', hl_id=deal.hl_id, deal_id=deal.id)
+
+    pipeline_id = deal.stage.hl_dealstage.hl_pipeline.hl_id
+    payload = build_opportunity_payload(deal)
+    client = get_client()
+    try:
+        if deal.hl_id:
+            action = 'updated'
+            response = client.put(f"pipelines/{pipeline_id}/opportunities/{deal.hl_id}", json=payload)
+        else:
+            action = 'created'
+            response = client.post(f"pipelines/{pipeline_id}/opportunities/", json=payload)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Failed to sync deal: {deal.ac_id}. {e}")
+        return SyncResult(deal.contact_id, 'failed', hl_id=deal.hl_id, error=str(e), deal_id=deal.id)
+
+    if response.status_code in (200, 201):
+        if not deal.hl_id:
+            data = response.json()
+            deal.hl_id = data.get('opportunity', data)['id']
+        deal.hl_synced_hash = deal.content_hash
+        if writes is not None:
+            writes.update(deal, ['hl_id', 'hl_synced_hash'])
+        else:
+            deal.save(update_fields=['hl_id', 'hl_synced_hash'])
+        return SyncResult(deal.contact_id, action, hl_id=deal.hl_id, status_code=response.status_code, deal_id=deal.id)
+
+    logger.warning(f"Failed to sync deal: {deal.ac_id}. Status code: {response.status_code}. Response: {response.text}")
+    return SyncResult(deal.contact_id, 'failed', hl_id=deal.hl_id, status_code=response.status_code,
+                      error=response.text, deal_id=deal.id)
 
 def sync_all_contacts_to_highlevel(limit=None, test_mode=False):
-    """Sync all contacts to HighLevel"""
-    contacts = Contact.objects.all()
-    if limit:
-        contacts = contacts[:limit]
-    
+    """
+    Sync all contacts (the first `limit` by id) to HighLevel.
+    Contacts are loaded WRITE_BATCH_SIZE at a time, so memory stays flat however many there are.
+    Returns the SyncLog with the counts.
+    """
     # Create a new SyncLog entry
     sync_log = SyncLog.objects.create()
     
-    synced_contacts = []
-    for contact in tqdm(contacts, desc="Syncing contacts to HighLevel"):
-        if test_mode:
-            print(f"Syncing contact to HighLevel: {contact.first_name} {contact.last_name} (ID: {contact.ac_id})")
-        
-        sync_log.contacts_attempted += 1
-        if sync_contact_to_highlevel(contact):
-            synced_contacts.append(contact)
-            sync_log.contacts_synced += 1
-        
-        sync_log.save()  # Save the progress
+    # With the single writer, updates and progress are committed once per chunk
+    writes = WriteBuffer() if single_writer_enabled() else None
+    progress_fields = ['contacts_attempted', 'contacts_synced', 'contacts_skipped']
+
+    progress = tqdm(desc="Syncing contacts to HighLevel", unit="contacts")
+    for contact_ids in iter_id_chunks(Contact.objects.all(), WRITE_BATCH_SIZE, limit):
+        payloads = build_highlevel_payloads(contact_ids)
+        resolve_hl_ids_from_directory([contact for contact, payload in payloads if contact.needs_highlevel_sync()])
+        for contact, payload in payloads:
+            if test_mode:
+                print(f"Syncing contact to HighLevel: {contact.first_name} {contact.last_name} (ID: {contact.ac_id})")
+
+            if not contact.needs_highlevel_sync():
+                sync_log.contacts_skipped += 1
+                continue
+
+            sync_log.contacts_attempted += 1
+            result = sync_contact_to_highlevel(contact, payload=payload, lookup_directory=False, writes=writes)
+            if result.success:
+                sync_log.contacts_synced += 1
+            if writes is not None and result.action == 'created':
+                writes.flush()
+
+            if writes is None:
+                sync_log.save()  # Save the progress
+        progress.update(len(contact_ids))
+
+        if writes is not None:
+            writes.update(sync_log, progress_fields)
+            writes.flush()
+    progress.close()
     
     # Update the SyncLog entry
     sync_log.end_time = timezone.now()
     sync_log.status = 'Completed'
     sync_log.save()
     
-    return synced_contacts
-
+    return sync_log
 
 if __name__ == "__main__":
     sync_all_contacts_to_highlevel()
@@ -0,0 +1,71 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from sync.highlevel_sync import get_deals_to_push
+from sync.models import Contact, ContactCustomField, Deal, HighLevelOutbox, HLContact
+
+# Plan lines that read a whole table: SQLite's "SCAN <table>" without an index, PostgreSQL's "Seq Scan"
+TABLE_SCAN = re.compile(r'\bSCAN \w+$|\bSCAN TABLE \w+$|Seq Scan', re.MULTILINE)
+
+
+def get_sync_queries():
+    """
+    (description, queryset, reads_every_row) for the queries the ingest and the HighLevel push run per page or chunk.
+    `reads_every_row` marks queries that read every row whatever their plan shows, e.g. a primary key range
+    walk whose condition compares two columns of the row, which no index can answer.
+    """
+    ids = [1, 2, 3]
+    ac_ids = ['1', '2', '3']
+    return [
+        ("Stored contact hashes of an ingest page",
+         Contact.objects.filter(ac_id__in=ac_ids).values_list('ac_id', 'content_hash'), False),
+        ("Stored deal hashes of an ingest page",
+         Deal.objects.filter(ac_id__in=ac_ids).values_list('ac_id', 'content_hash'), False),
+        ("Window of pending outbox entries for a drain",
+         HighLevelOutbox.objects.filter(processed_at__isnull=True, created_at__lte=timezone.now(), contact_id__gt=0)
+         .order_by('contact_id').values_list('contact_id', flat=True)[:10000], False),
+        ("Contacts of a push chunk",
+         Contact.objects.filter(id__in=ids).order_by('id'), False),
+        ("Custom field values of a push chunk",
+         ContactCustomField.objects.filter(contact_id__in=ids).only('contact_id', 'custom_field_id', 'value'), False),
+        ("HighLevel directory lookup by email",
+         HLContact.objects.filter(normalized_email__in=['a@example.com']).values_list('normalized_email', 'hl_id'), False),
+        ("Contacts already holding HighLevel ids",
+         Contact.objects.filter(hl_id__in=['a']).values_list('hl_id', flat=True), False),
+        ("Latest deals of a contact",
+         Deal.objects.filter(contact_id=1).order_by('-updated_date').values_list('id', flat=True), False),
+        # Walks the deals by id, checking content_hash against hl_synced_hash row by row
+        ("Window of deals to push", get_deals_to_push().filter(id__gt=0)[:10000], True),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Prints the query plans (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on PostgreSQL) of the hot sync '
+        'queries and flags full table scans. PostgreSQL may choose sequential scans on small tables, '
+        'so check it against a realistically sized database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help='Run the queries (EXPLAIN ANALYZE, PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        scans = 0
+        for description, queryset, reads_every_row in get_sync_queries():
+            plan = queryset.explain(**explain_options)
+            self.stdout.write(self.style.MIGRATE_HEADING(description))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(plan)
+            if reads_every_row or TABLE_SCAN.search(plan):
+                scans += 1
+                self.stdout.write(self.style.WARNING('Full table scan'))
+            self.stdout.write('')
+
+        if scans:
+            self.stdout.write(self.style.WARNING(f'{scans} queries scan a whole table'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All sync queries use indexes'))
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0005_synclog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synclog',
+            name='sync_type',
+            field=models.CharField(default='full', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='synclog',
+            name='watermark',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
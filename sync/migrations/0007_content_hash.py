@@ -0,0 +1,38 @@
+# Generated by Django 5.0.1 on 2026-10-18 00:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0006_synclog_delta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='hl_synced_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='deal',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='synclog',
+            name='contacts_changed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='synclog',
+            name='contacts_skipped',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0007_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synclog',
+            name='contacts_failed',
+            field=models.IntegerField(default=0),
+        ),
+    ]
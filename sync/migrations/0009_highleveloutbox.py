@@ -0,0 +1,42 @@
+# Generated by Django 5.0.1 on 2026-10-18 00:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, Q
+
+
+def enqueue_unsynced_contacts(apps, schema_editor):
+    """Contacts not pushed since their last change start out dirty"""
+    Contact = apps.get_model('sync', 'Contact')
+    HighLevelOutbox = apps.get_model('sync', 'HighLevelOutbox')
+    contact_ids = Contact.objects.filter(
+        Q(content_hash__isnull=True) | Q(hl_synced_hash__isnull=True) | ~Q(hl_synced_hash=F('content_hash'))
+    ).values_list('id', flat=True)
+    HighLevelOutbox.objects.bulk_create(
+        (HighLevelOutbox(contact_id=contact_id) for contact_id in contact_ids.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0008_synclog_contacts_failed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HighLevelOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('contact', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='sync.contact')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'created_at'], name='sync_highle_process_f17990_idx')],
+            },
+        ),
+        migrations.RunPython(enqueue_unsynced_contacts, migrations.RunPython.noop),
+    ]
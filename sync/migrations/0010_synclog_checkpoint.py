@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-18 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0009_highleveloutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synclog',
+            name='checkpoint_last_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='synclog',
+            name='checkpoint_phase',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='synclog',
+            name='updated_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
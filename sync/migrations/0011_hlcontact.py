@@ -0,0 +1,24 @@
+# Generated by Django 5.0.1 on 2026-10-18 00:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0010_synclog_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HLContact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hl_id', models.CharField(max_length=200, unique=True)),
+                ('email', models.CharField(blank=True, max_length=200, null=True)),
+                ('normalized_email', models.CharField(blank=True, db_index=True, max_length=200, null=True)),
+                ('imported_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-18 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0011_hlcontact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deal',
+            name='hl_synced_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='synclog',
+            name='deals_failed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='synclog',
+            name='deals_synced',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.1 on 2026-10-18 00:54
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_contact_custom_fields(apps, schema_editor):
+    """Keep the latest value of each (contact, custom field) pair so the unique constraint can be added"""
+    ContactCustomField = apps.get_model('sync', 'ContactCustomField')
+    duplicates = (
+        ContactCustomField.objects.values('contact_id', 'custom_field_id')
+        .annotate(count=Count('id'), keep_id=Max('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        ContactCustomField.objects.filter(
+            contact_id=duplicate['contact_id'], custom_field_id=duplicate['custom_field_id']
+        ).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0012_deal_push'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contact',
+            name='email',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['contact', 'updated_date'], name='sync_deal_contact_08d0a0_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_contact_custom_fields, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='contactcustomfield',
+            constraint=models.UniqueConstraint(fields=('contact', 'custom_field'), name='unique_contact_custom_field'),
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.0.1 on 2026-10-18 00:56
+
+import json
+import zlib
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+# Keys the ingest added to the AC contact, stored in ContactCustomField and Deal
+NESTED_KEYS = ('custom_fields', 'deals')
+
+
+def decode(value):
+    """ac_json values were saved as json.dumps(...) strings inside the JSON column"""
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def move_contact_payloads(apps, schema_editor):
+    """Copy each contact's own AC fields into ContactRawPayload, compacted and optionally compressed"""
+    Contact = apps.get_model('sync', 'Contact')
+    ContactRawPayload = apps.get_model('sync', 'ContactRawPayload')
+    compressed = getattr(settings, 'SYNC_PAYLOAD_COMPRESSION', 'zlib') == 'zlib'
+
+    rows = []
+    for contact_id, ac_json in Contact.objects.filter(ac_json__isnull=False).values_list('id', 'ac_json').iterator(BATCH_SIZE):
+        payload = decode(ac_json)
+        if not isinstance(payload, dict):
+            continue
+        data = json.dumps(
+            {key: value for key, value in payload.items() if key not in NESTED_KEYS}, separators=(',', ':'), sort_keys=True
+        ).encode()
+        rows.append(ContactRawPayload(contact_id=contact_id, data=zlib.compress(data) if compressed else data, compressed=compressed))
+        if len(rows) >= BATCH_SIZE:
+            ContactRawPayload.objects.bulk_create(rows)
+            rows = []
+    ContactRawPayload.objects.bulk_create(rows)
+
+
+def restore_contact_payloads(apps, schema_editor):
+    Contact = apps.get_model('sync', 'Contact')
+    ContactRawPayload = apps.get_model('sync', 'ContactRawPayload')
+    contacts = []
+    for raw in ContactRawPayload.objects.iterator(BATCH_SIZE):
+        data = bytes(raw.data)
+        contacts.append(Contact(id=raw.contact_id, ac_json=json.loads(zlib.decompress(data) if raw.compressed else data)))
+        if len(contacts) >= BATCH_SIZE:
+            Contact.objects.bulk_update(contacts, ['ac_json'])
+            contacts = []
+    Contact.objects.bulk_update(contacts, ['ac_json'])
+
+
+def decode_ac_json(apps, schema_editor):
+    """Store the remaining ac_json columns as JSON objects instead of JSON-encoded strings"""
+    for model_name in ('CustomField', 'PipeLine', 'DealStage', 'Deal'):
+        model = apps.get_model('sync', model_name)
+        last_id = 0
+        while True:
+            # Paged by id rather than iterated, since the rows are updated along the way
+            batch = list(model.objects.filter(id__gt=last_id).order_by('id').only('id', 'ac_json')[:BATCH_SIZE])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            rows = [obj for obj in batch if isinstance(obj.ac_json, str)]
+            for obj in rows:
+                obj.ac_json = json.loads(obj.ac_json)
+            model.objects.bulk_update(rows, ['ac_json'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0013_sync_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContactRawPayload',
+            fields=[
+                ('contact', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='raw_payload', serialize=False, to='sync.contact')),
+                ('data', models.BinaryField()),
+                ('compressed', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.RunPython(move_contact_payloads, restore_contact_payloads),
+        migrations.RunPython(decode_ac_json, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='contact',
+            name='ac_json',
+        ),
+    ]
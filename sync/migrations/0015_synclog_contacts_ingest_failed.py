@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0014_contact_raw_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synclog',
+            name='contacts_ingest_failed',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.0.1 on 2026-10-18 02:10
+
+import hashlib
+import json
+import zlib
+from collections import defaultdict
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def payload_hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def rehash_contacts(apps, schema_editor):
+    """
+    Contact hashes no longer cover deals. Recompute them from the stored payloads and custom field
+    values; contacts already pushed with the old hash keep matching, so they aren't pushed again.
+    """
+    Contact = apps.get_model('sync', 'Contact')
+    ContactRawPayload = apps.get_model('sync', 'ContactRawPayload')
+    ContactCustomField = apps.get_model('sync', 'ContactCustomField')
+
+    last_id = 0
+    while True:
+        # Paged by id rather than iterated, since the rows are updated along the way
+        contacts = list(
+            Contact.objects.filter(id__gt=last_id, content_hash__isnull=False)
+            .order_by('id').only('id', 'content_hash', 'hl_synced_hash')[:BATCH_SIZE]
+        )
+        if not contacts:
+            break
+        last_id = contacts[-1].id
+        ids = [contact.id for contact in contacts]
+
+        payloads = {}
+        for raw in ContactRawPayload.objects.filter(contact_id__in=ids):
+            data = bytes(raw.data)
+            payloads[raw.contact_id] = json.loads(zlib.decompress(data) if raw.compressed else data)
+        field_values = defaultdict(dict)
+        for contact_id, field_ac_id, value in ContactCustomField.objects.filter(contact_id__in=ids).values_list(
+            'contact_id', 'custom_field__ac_id', 'value'
+        ):
+            field_values[contact_id][str(field_ac_id)] = value
+
+        changed = []
+        for contact in contacts:
+            if contact.id not in payloads:
+                # Without a payload the hash can't be rebuilt; the next sync rewrites the contact
+                continue
+            content_hash = payload_hash({
+                'contact': {k: v for k, v in payloads[contact.id].items() if k not in ('links', 'custom_fields', 'deals')},
+                'custom_fields': field_values[contact.id],
+            })
+            if contact.hl_synced_hash == contact.content_hash:
+                contact.hl_synced_hash = content_hash
+            contact.content_hash = content_hash
+            changed.append(contact)
+        Contact.objects.bulk_update(changed, ['content_hash', 'hl_synced_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0015_synclog_contacts_ingest_failed'),
+    ]
+
+    operations = [
+        migrations.RunPython(rehash_contacts, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,10 @@ from django.db import models
 
 # models.py 
 
+import json
+import zlib
+
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
@@ -17,15 +21,52 @@ class Automation(models.Model):
 class Contact(models.Model):
     first_name = models.CharField(max_length=200)
     last_name = models.CharField(max_length=200)
-    email = models.CharField(max_length=200)
+    email = models.CharField(max_length=200, db_index=True)
     ac_id = models.CharField(max_length=200, unique=True)
     hl_id = models.CharField(max_length=200, unique=True, blank=True, null=True)
-    ac_json = models.JSONField(blank=True, null=True)
+    # Hash of the normalized AC payload (contact and custom fields)
+    content_hash = models.CharField(max_length=64, blank=True, null=True)
+    # content_hash as of the last successful push to HighLevel
+    hl_synced_hash = models.CharField(max_length=64, blank=True, null=True)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
+
+    def needs_highlevel_sync(self):
+        return not self.content_hash or self.hl_synced_hash != self.content_hash
     
 
+class ContactRawPayload(models.Model):
+    """
+    The contact's own fields from its AC payload, kept out of the Contact row.
+    Custom field values and deals are left out; they are stored in their own tables.
+    Stored as compact JSON, zlib-compressed when SYNC_PAYLOAD_COMPRESSION is 'zlib'.
+    """
+    # Keys the ingest adds to the AC contact, stored in ContactCustomField and Deal
+    NESTED_KEYS = ('custom_fields', 'deals')
+
+    contact = models.OneToOneField(Contact, on_delete=models.CASCADE, primary_key=True, related_name='raw_payload')
+    data = models.BinaryField()
+    compressed = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.contact_id} ({len(self.data)} bytes)"
+
+    @classmethod
+    def from_contact(cls, contact_id, contact):
+        """Unsaved row for an AC contact payload (with or without the nested keys)"""
+        own_fields = {key: value for key, value in contact.items() if key not in cls.NESTED_KEYS}
+        data = json.dumps(own_fields, separators=(',', ':'), sort_keys=True).encode()
+        compressed = getattr(settings, 'SYNC_PAYLOAD_COMPRESSION', 'zlib') == 'zlib'
+        if compressed:
+            data = zlib.compress(data)
+        return cls(contact_id=contact_id, data=data, compressed=compressed)
+
+    def load(self):
+        data = bytes(self.data)
+        return json.loads(zlib.decompress(data) if self.compressed else data)
+
+
 class CustomField(models.Model):
     ac_id = models.CharField(max_length=200, unique=True)
     hl_id = models.CharField(max_length=200, unique=True, blank=True, null=True)
@@ -45,6 +86,11 @@ class ContactCustomField(models.Model):
     custom_field = models.ForeignKey(CustomField, on_delete=models.CASCADE)
     value = models.CharField(max_length=500)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['contact', 'custom_field'], name='unique_contact_custom_field'),
+        ]
+
     def __str__(self):
         return f"{self.contact} - {self.custom_field}: {self.value}"
     
@@ -106,17 +152,64 @@ class Deal(models.Model):
     currency = models.CharField(max_length=3, default='USD')
     created_date = models.DateTimeField(null=True, blank=True)
     updated_date = models.DateTimeField(null=True, blank=True)
+    # Hash of the normalized AC deal payload
+    content_hash = models.CharField(max_length=64, blank=True, null=True)
+    # content_hash as of the last successful push to HighLevel
+    hl_synced_hash = models.CharField(max_length=64, blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['contact', 'updated_date'])]
 
     def __str__(self):
         return f"{self.title or 'Untitled Deal'} - {self.contact}"
 
+    def needs_highlevel_sync(self):
+        return not self.content_hash or self.hl_synced_hash != self.content_hash
+
+class HLContact(models.Model):
+    """Contacts that already exist in HighLevel, imported so pushes can match local contacts by email"""
+    hl_id = models.CharField(max_length=200, unique=True)
+    email = models.CharField(max_length=200, blank=True, null=True)
+    normalized_email = models.CharField(max_length=200, blank=True, null=True, db_index=True)
+    imported_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.email} ({self.hl_id})"
+
+class HighLevelOutbox(models.Model):
+    """Contacts changed by the ingest that still need to be pushed to HighLevel"""
+    contact = models.OneToOneField(Contact, on_delete=models.CASCADE, related_name='outbox')
+    created_at = models.DateTimeField(default=timezone.now)  # time of the latest change
+    processed_at = models.DateTimeField(blank=True, null=True)  # null while the contact is dirty
+
+    class Meta:
+        indexes = [models.Index(fields=['processed_at', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.contact} ({'pending' if self.processed_at is None else 'pushed'})"
+
 class SyncLog(models.Model):
     start_time = models.DateTimeField(default=timezone.now)
     end_time = models.DateTimeField(blank=True, null=True)
     contacts_attempted = models.IntegerField(default=0)
     contacts_synced = models.IntegerField(default=0)
+    contacts_failed = models.IntegerField(default=0)
     status = models.CharField(max_length=50, default='In Progress')  # e.g., 'In Progress', 'Completed', 'Failed'
     error_message = models.TextField(blank=True, null=True)
+    contacts_changed = models.IntegerField(default=0)
+    contacts_skipped = models.IntegerField(default=0)  # fetched but unchanged since the last sync
+    # Fetched but not stored; while any are, the watermark isn't advanced so the next delta sync refetches them
+    contacts_ingest_failed = models.IntegerField(default=0)
+    deals_synced = models.IntegerField(default=0)
+    deals_failed = models.IntegerField(default=0)
+    sync_type = models.CharField(max_length=20, default='full')  # 'full', 'delta', 'push' or 'directory' (HighLevel contact import)
+    # Set on success: the next delta sync fetches records modified after this time
+    watermark = models.DateTimeField(blank=True, null=True)
+    # Change window of a delta sync, kept so a resumed run fetches the same changes
+    updated_since = models.DateTimeField(blank=True, null=True)
+    # Resume point: the phase reached ('pipelines', 'contacts', 'push') and the last AC contact id stored
+    checkpoint_phase = models.CharField(max_length=20, blank=True, null=True)
+    checkpoint_last_id = models.BigIntegerField(blank=True, null=True)
 
     def time_taken(self):
         if self.end_time:
@@ -0,0 +1,164 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Sentinel telling the next stage that no more items will come
+_DONE = object()
+
+
+class StageStats:
+    """Throughput counters for one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.pages = 0
+        self.contacts = 0
+        self.busy = 0.0  # seconds spent doing the stage's own work
+        self.blocked = 0.0  # seconds spent waiting on a full output queue (backpressure)
+        self.lock = threading.Lock()
+
+    def record(self, contacts, busy):
+        with self.lock:
+            self.pages += 1
+            self.contacts += contacts
+            self.busy += busy
+
+    def record_blocked(self, blocked):
+        with self.lock:
+            self.blocked += blocked
+
+    def add(self, other):
+        """Fold in the counters of the same stage from another pipeline run"""
+        with self.lock:
+            self.pages += other.pages
+            self.contacts += other.contacts
+            self.busy += other.busy
+            self.blocked += other.blocked
+
+    def contacts_per_second(self):
+        return self.contacts / self.busy if self.busy else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.pages} pages, {self.contacts} contacts, "
+            f"{self.busy:.1f}s busy ({self.contacts_per_second():.1f} contacts/s), "
+            f"{self.blocked:.1f}s blocked downstream"
+        )
+
+
+def run_pipeline(page_params, fetch_page, enrich_page, persist_page, fetch_workers=1, enrich_workers=1, queue_size=4):
+    """
+    Run fetch -> enrich -> persist as a streaming pipeline connected by bounded queues.
+
+    fetch_page(params) -> page and enrich_page(page) -> contacts run on worker threads;
+    persist_page(contacts) runs on the calling thread so database writes stay on its
+    connection and transaction. A full queue blocks the stage feeding it, so no stage
+    runs more than `queue_size` pages ahead of the next one.
+
+    The first exception in any stage stops every stage and is re-raised here once all
+    threads have exited. Returns the StageStats of the fetch, enrich and persist stages.
+    """
+    stats = [StageStats('fetch'), StageStats('enrich'), StageStats('persist')]
+    fetch_stats, enrich_stats, persist_stats = stats
+    fetched = queue.Queue(maxsize=queue_size)
+    enriched = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    params_lock = threading.Lock()
+    page_params = iter(page_params)
+    remaining = {'fetch': fetch_workers, 'enrich': enrich_workers}
+    remaining_lock = threading.Lock()
+
+    def put(q, item, stage_stats):
+        started = time.monotonic()
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stage_stats.record_blocked(time.monotonic() - started)
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def finish(stage, q, sentinels):
+        # The last worker of a stage tells the next stage to finish
+        with remaining_lock:
+            remaining[stage] -= 1
+            last = remaining[stage] == 0
+        if last:
+            for _ in range(sentinels):
+                put(q, _DONE, fetch_stats if stage == 'fetch' else enrich_stats)
+
+    def fetch_worker():
+        try:
+            while not stop.is_set():
+                with params_lock:
+                    params = next(page_params, _DONE)
+                if params is _DONE:
+                    break
+                started = time.monotonic()
+                page = fetch_page(params)
+                fetch_stats.record(len(page['contacts']), time.monotonic() - started)
+                put(fetched, page, fetch_stats)
+        except Exception as e:
+            logger.error(f"Fetch stage failed: {e}")
+            errors.append(e)
+            stop.set()
+        finally:
+            finish('fetch', fetched, enrich_workers)
+
+    def enrich_worker():
+        try:
+            while not stop.is_set():
+                page = get(fetched)
+                if page is _DONE:
+                    break
+                started = time.monotonic()
+                contacts = enrich_page(page)
+                enrich_stats.record(len(contacts), time.monotonic() - started)
+                put(enriched, contacts, enrich_stats)
+        except Exception as e:
+            logger.error(f"Enrich stage failed: {e}")
+            errors.append(e)
+            stop.set()
+        finally:
+            finish('enrich', enriched, 1)
+
+    threads = [
+        threading.Thread(target=fetch_worker, name=f'pipeline-fetch-{i}', daemon=True) for i in range(fetch_workers)
+    ] + [
+        threading.Thread(target=enrich_worker, name=f'pipeline-enrich-{i}', daemon=True) for i in range(enrich_workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            contacts = get(enriched)
+            if contacts is _DONE:
+                break
+            started = time.monotonic()
+            persist_page(contacts)
+            persist_stats.record(len(contacts), time.monotonic() - started)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        if errors:
+            stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return stats
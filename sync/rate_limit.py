@@ -0,0 +1,257 @@
+import hashlib
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - redis is in requirements, but the limiter still works without it
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# How long to stay on the in-memory bucket after Redis could not be reached
+REDIS_RETRY_INTERVAL = 30
+
+# Rate adaptation: halve on 429, then climb back by 2% of the ceiling per successful response
+DECREASE_FACTOR = 0.5
+INCREASE_FRACTION = 0.02
+MIN_RATE = 0.2
+
+# Longest one response may block the bucket, whatever its Retry-After or reset header says
+MAX_BLOCK_SECONDS = 60
+
+
+def get_retry_after(response):
+    """Seconds to wait according to a Retry-After header (delta-seconds or HTTP date), or None"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _header_float(response, *names):
+    for name in names:
+        value = response.headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+def parse_rate_limit_headers(response):
+    """
+    Read common rate-limit headers.
+    Returns (ceiling in requests/second or None, seconds to wait before the window resets or None).
+    """
+    limit = _header_float(response, 'X-RateLimit-Max', 'X-RateLimit-Limit', 'RateLimit-Limit')
+    interval_ms = _header_float(response, 'X-RateLimit-Interval-Milliseconds')
+    remaining = _header_float(response, 'X-RateLimit-Remaining', 'RateLimit-Remaining')
+    reset = _header_float(response, 'X-RateLimit-Reset', 'RateLimit-Reset')
+
+    ceiling = None
+    if limit and interval_ms:
+        ceiling = limit / (interval_ms / 1000)
+
+    wait = None
+    if remaining is not None and remaining <= 0 and reset is not None:
+        # Reset is either seconds until reset or an epoch timestamp
+        wait = reset - time.time() if reset > 10 ** 9 else reset
+        wait = max(0.0, wait)
+    return ceiling, wait
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Take a token; returns 0 on success, otherwise the seconds to wait before trying again"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def adjust(self, throttled, block_for, ceiling, max_rate):
+        with self.lock:
+            max_rate = min(max_rate, ceiling) if ceiling else max_rate
+            if throttled:
+                self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+                self.tokens = 0
+            else:
+                self.rate = min(max_rate, self.rate + max_rate * INCREASE_FRACTION)
+            self.rate = min(self.rate, max_rate)
+            if block_for:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + block_for)
+
+
+# KEYS[1]: bucket hash. ARGV: default rate, capacity. Returns the wait in seconds as a string (0 = token taken).
+TAKE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'rate', 'tokens', 'updated', 'blocked_until')
+local rate = tonumber(state[1]) or tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local tokens = tonumber(state[2]) or capacity
+local updated = tonumber(state[3]) or now
+local blocked_until = tonumber(state[4]) or 0
+if now < blocked_until then
+    return tostring(blocked_until - now)
+end
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'rate', tostring(rate), 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+# KEYS[1]: bucket hash. ARGV: throttled (0/1), block_for seconds, ceiling (0 = none), max rate,
+# decrease factor, increase fraction, min rate.
+ADJUST_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local max_rate = tonumber(ARGV[4])
+local ceiling = tonumber(ARGV[3])
+if ceiling > 0 and ceiling < max_rate then
+    max_rate = ceiling
+end
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or max_rate
+if ARGV[1] == '1' then
+    rate = math.max(tonumber(ARGV[7]), rate * tonumber(ARGV[5]))
+    redis.call('HSET', KEYS[1], 'tokens', '0', 'updated', tostring(now))
+else
+    rate = rate + max_rate * tonumber(ARGV[6])
+end
+rate = math.min(rate, max_rate)
+redis.call('HSET', KEYS[1], 'rate', tostring(rate))
+local block_for = tonumber(ARGV[2])
+if block_for > 0 then
+    local blocked_until = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+    redis.call('HSET', KEYS[1], 'blocked_until', tostring(math.max(blocked_until, now + block_for)))
+end
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(rate)
+"""
+
+
+def get_redis_client():
+    url = getattr(settings, 'RATE_LIMIT_REDIS_URL', None)
+    if not url or redis is None:
+        return None
+    return redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+
+class SharedRateLimiter:
+    """
+    Token-bucket limiter shared by every process talking to one API account.
+
+    The bucket lives in Redis (RATE_LIMIT_REDIS_URL, the Celery broker by default) so the web
+    process, Celery workers and django_q workers draw from the same budget. If Redis can't be
+    reached the limiter falls back to an in-process bucket and retries Redis later.
+
+    The rate adapts to the server: a 429 halves it and blocks for Retry-After, successful
+    responses raise it back towards the ceiling, and rate-limit headers lower the ceiling
+    or block until the window resets.
+    """
+
+    def __init__(self, name, max_rate, capacity=None, redis_client=None):
+        self.name = name
+        self.key = f"ratelimit:{name}"
+        self.max_rate = max_rate
+        self.capacity = capacity or max(1.0, max_rate)
+        self.ceiling = None
+        self.local = TokenBucket(max_rate, self.capacity)
+        self.redis = redis_client if redis_client is not None else get_redis_client()
+        self.redis_retry_at = 0.0
+        if self.redis is not None:
+            self.take_script = self.redis.register_script(TAKE_SCRIPT)
+            self.adjust_script = self.redis.register_script(ADJUST_SCRIPT)
+
+    def _use_redis(self):
+        return self.redis is not None and time.monotonic() >= self.redis_retry_at
+
+    def _redis_failed(self, error):
+        logger.warning(f"Rate limiter {self.name} can't reach Redis, using the in-memory bucket: {error}")
+        self.redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+
+    def take(self):
+        if self._use_redis():
+            try:
+                return float(self.take_script(keys=[self.key], args=[self.max_rate, self.capacity]))
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        return self.local.take()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def observe(self, response):
+        """Adapt the shared rate to a response's status code and rate-limit headers"""
+        throttled = response.status_code == 429
+        ceiling, block_for = parse_rate_limit_headers(response)
+        if ceiling:
+            self.ceiling = ceiling
+        if throttled:
+            retry_after = get_retry_after(response)
+            block_for = max(block_for or 0, retry_after if retry_after is not None else 1.0)
+        block_for = min(block_for or 0, MAX_BLOCK_SECONDS)
+        if throttled:
+            logger.warning(f"Rate limited by {self.name}, backing off for {block_for:.1f}s")
+
+        if self._use_redis():
+            try:
+                self.adjust_script(keys=[self.key], args=[
+                    int(throttled), block_for or 0, self.ceiling or 0, self.max_rate,
+                    DECREASE_FACTOR, INCREASE_FRACTION, MIN_RATE,
+                ])
+                return
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        self.local.adjust(throttled, block_for, self.ceiling, self.max_rate)
+
+
+def account_key(*parts):
+    """Short, stable key for an API account that doesn't expose the credentials"""
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()[:12]
@@ -0,0 +1,92 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CustomField, DealStage, PipeLine
+
+logger = logging.getLogger(__name__)
+
+# Reference tables resolved by AC id during the ingest
+REFERENCE_MODELS = {
+    'custom_fields': CustomField,
+    'pipelines': PipeLine,
+    'stages': DealStage,
+}
+
+CACHE_KEY_PREFIX = 'sync:reference_ids:'
+
+
+def get_cache_timeout():
+    """Seconds the maps are shared through Django's cache between runs; 0 keeps them per run"""
+    return getattr(settings, 'SYNC_REFERENCE_IDS_CACHE_TIMEOUT', 0)
+
+
+class ReferenceIds:
+    """
+    AC id -> primary key maps for custom fields, pipelines and deal stages.
+
+    There are only a few hundred of these rows, so they are loaded once per run (one query
+    per table, or none when the maps are shared through Django's cache) and the ingest
+    resolves ids from memory. Rows the maps don't know yet are created in bulk, never
+    updated, like get_or_create, and added to the maps once their transaction commits.
+    """
+
+    def __init__(self, maps=None):
+        self.maps = {name: dict((maps or {}).get(name, {})) for name in REFERENCE_MODELS}
+
+    @classmethod
+    def load(cls, use_cache=True):
+        """Load every map, from Django's cache when enabled and warm, otherwise from the database"""
+        timeout = get_cache_timeout() if use_cache else 0
+        maps = {}
+        for name, model in REFERENCE_MODELS.items():
+            ids = cache.get(CACHE_KEY_PREFIX + name) if timeout else None
+            if ids is None:
+                ids = dict(model.objects.values_list('ac_id', 'id'))
+                if timeout:
+                    cache.set(CACHE_KEY_PREFIX + name, ids, timeout)
+            maps[name] = ids
+        return cls(maps)
+
+    def __getitem__(self, name):
+        return self.maps[name]
+
+    def resolve(self, name, items, build):
+        """
+        Primary keys for `items` ({ac_id: payload}) in the `name` map.
+        Unknown ids are created with build(ac_id, payload) -> unsaved instance.
+        Returns {ac_id: pk} for every item.
+        """
+        known = self.maps[name]
+        ids = {ac_id: known[ac_id] for ac_id in items if ac_id in known}
+        missing = {ac_id: payload for ac_id, payload in items.items() if ac_id not in known}
+        if missing:
+            model = REFERENCE_MODELS[name]
+            model.objects.bulk_create(
+                [build(ac_id, payload) for ac_id, payload in missing.items()], ignore_conflicts=True
+            )
+            created = dict(model.objects.filter(ac_id__in=missing).values_list('ac_id', 'id'))
+            ids.update(created)
+            self.remember(name, created)
+        return ids
+
+    def remember(self, name, ids):
+        """Add rows to a map once the current transaction commits, so a rollback can't leave stale ids"""
+        if not ids:
+            return
+
+        def update():
+            self.maps[name].update(ids)
+            if get_cache_timeout():
+                cache.set(CACHE_KEY_PREFIX + name, self.maps[name], get_cache_timeout())
+
+        transaction.on_commit(update)
+
+    def reload(self):
+        """Reload every map from the database, e.g. after rows were deleted or a write failed"""
+        self.maps = ReferenceIds.load(use_cache=False).maps
+        if get_cache_timeout():
+            for name, ids in self.maps.items():
+                cache.set(CACHE_KEY_PREFIX + name, ids, get_cache_timeout())
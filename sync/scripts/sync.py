@@ -1,43 +1,144 @@
 import os
 import requests
 import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from itertools import islice
 from dotenv import load_dotenv
 from tqdm import tqdm
 from datetime import timedelta
 import json
+import hashlib
 from django.utils.dateparse import parse_datetime
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, before_sleep_log
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, before_sleep_log, RetryError
 import time
-from requests_ratelimiter import LimiterSession
 import logging
 from django.db import transaction
 from django.utils import timezone
-from celery import shared_task
+from celery import shared_task, chord, group
 
 # Move the imports that depend on Django here
-from sync.models import Contact, CustomField, ContactCustomField, Deal, DealStage, PipeLine, SyncLog
-from ..highlevel_sync import check_api_connection, sync_contact_to_highlevel
+from sync.models import Contact, ContactRawPayload, CustomField, ContactCustomField, Deal, DealStage, HighLevelOutbox, PipeLine, SyncLog
+from ..bulk_load import bulk_upsert
+from ..pipeline import run_pipeline
+from ..reference_ids import ReferenceIds
+from ..write_queue import WriteBuffer, get_writer_queue, single_writer_enabled
+from ..rate_limit import SharedRateLimiter, account_key
+from ..highlevel_sync import (
+    build_highlevel_payloads, check_api_connection, get_client, get_deals_to_push, import_highlevel_contacts,
+    import_highlevel_contacts_if_stale, mark_contacts_dirty, resolve_hl_ids_from_directory, sync_contact_to_highlevel,
+    sync_deal_to_highlevel, sync_highlevel_custom_fields, sync_highlevel_pipelines
+)
 
-# Load environment variables and set up request caching
+# Load environment variables
 load_dotenv()
-requests_cache.install_cache('activecampaign_cache', expire_after=timedelta(hours=24))
 
-# Create a rate-limited session that works with the cache
-class CachedLimiterSession(LimiterSession):
+# Create a rate-limited session
+class RateLimitedSession(requests.Session):
+    """
+    Session drawing every request from a shared rate limiter.
+    A 429 adapts the limiter and the request is sent again once the limiter allows it.
+    """
+
+    def __init__(self, limiter, max_throttle_retries=3, **kwargs):
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.max_throttle_retries = max_throttle_retries
+
     def send(self, request, **kwargs):
-        with requests_cache.disabled():
-            return super().send(request, **kwargs)
+        for attempt in range(self.max_throttle_retries + 1):
+            self.limiter.acquire()
+            response = super().send(request, **kwargs)
+            self.limiter.observe(response)
+            if response.status_code != 429:
+                break
+        return response
+
+class CachedLimiterSession(requests_cache.CacheMixin, RateLimitedSession):
+    """
+    Rate-limited session with an HTTP cache for slowly-changing reference data.
+    Only URLs listed in REFERENCE_CACHE_TTLS are cached; expired entries are revalidated with
+    ETag/If-Modified-Since when AC sent validators, and the cache is trimmed to `max_entries`.
+    """
+
+    def __init__(self, *args, max_entries=500, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_entries = max_entries
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if not getattr(response, 'from_cache', False):
+            self.evict()
+        return response
+
+    def evict(self):
+        """Drop the oldest entries once the cache holds more than max_entries responses"""
+        responses = self.cache.responses
+        excess = len(responses) - self.max_entries
+        if excess > 0:
+            oldest = sorted(responses.items(), key=lambda item: item[1].created_at)[:excess]
+            self.cache.delete(*(key for key, response in oldest))
+
+# Requests per second allowed by the ActiveCampaign account, shared by every thread and process
+AC_REQUESTS_PER_SECOND = float(os.environ.get("ACTIVECAMPAIGN_REQUESTS_PER_SECOND", 5))
+
+# Number of page/sub-resource requests kept in flight when fetching contacts. Contact pages are
+# only fetched concurrently with offset pagination; a keyset walk fetches them one at a time and
+# the setting then applies to the /deals scan and the per-contact sub-requests
+AC_FETCH_CONCURRENCY = int(os.environ.get("ACTIVECAMPAIGN_FETCH_CONCURRENCY", 4))
+AC_MAX_FETCH_CONCURRENCY = 32
+
+# 'keyset' walks contacts in id order (flat per-page latency, stable under inserts/deletes) one
+# page at a time, as each page starts after the previous one's last id; 'offset' fetches numbered
+# pages concurrently (ACTIVECAMPAIGN_FETCH_CONCURRENCY)
+AC_PAGINATION = os.environ.get("ACTIVECAMPAIGN_PAGINATION", "keyset")
+
+# Delta syncs fetch records modified since the last successful sync, with some overlap for clock skew
+AC_UPDATED_AFTER_FILTER = "filters[updated_after]"
+DELTA_SYNC_OVERLAP = timedelta(minutes=10)
+# A full sync is forced when the last one is older than this
+FULL_SYNC_INTERVAL = timedelta(days=int(os.environ.get("SYNC_FULL_INTERVAL_DAYS", 7)))
+
+# Number of contacts pushed to HighLevel by each Celery task
+HIGHLEVEL_PUSH_CHUNK_SIZE = int(os.environ.get("HIGHLEVEL_PUSH_CHUNK_SIZE", 200))
+# Chunks enqueued at a time; the next window is read once the previous one has finished
+HIGHLEVEL_PUSH_WINDOW_CHUNKS = int(os.environ.get("HIGHLEVEL_PUSH_WINDOW_CHUNKS", 50))
 
 # Create the session with rate limiting
-session = CachedLimiterSession(per_second=5, concurrent=1)  # Limit to 5 requests per second and 1 concurrent request
+ac_limiter = SharedRateLimiter(f"ac:{account_key(os.environ.get('ACTIVECAMPAIGN_URL'))}", AC_REQUESTS_PER_SECOND)
+session = RateLimitedSession(ac_limiter)
+# Keep enough keep-alive connections around for every fetch thread
+session.mount('https://', HTTPAdapter(pool_maxsize=AC_MAX_FETCH_CONCURRENCY))
+session.mount('http://', HTTPAdapter(pool_maxsize=AC_MAX_FETCH_CONCURRENCY))
+
+# TTL per reference endpoint; anything else (contacts, deals, field values) is never cached
+REFERENCE_CACHE_TTLS = {
+    '*/api/3/dealGroups': timedelta(hours=24),
+    '*/api/3/dealStages': timedelta(hours=24),
+    '*/api/3/fields': timedelta(hours=6),
+    '*': requests_cache.DO_NOT_CACHE,
+}
+
+# Cached session for reference data, sharing the account's rate limit
+reference_session = CachedLimiterSession(
+    limiter=ac_limiter,
+    cache_name=os.environ.get("ACTIVECAMPAIGN_REFERENCE_CACHE", "activecampaign_reference_cache"),
+    expire_after=requests_cache.DO_NOT_CACHE,
+    urls_expire_after=REFERENCE_CACHE_TTLS,
+    allowable_methods=('GET',),
+    ignored_parameters=('Api-Token',),
+    stale_if_error=True,
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def make_request(method, url, use_retry=True, **kwargs):
+def make_request(method, url, use_retry=True, http_session=None, **kwargs):
     try:
-        response = session.request(method, url, **kwargs)
+        response = (http_session or session).request(method, url, **kwargs)
         response.raise_for_status()
         return response
     except requests.exceptions.RequestException as e:
@@ -57,37 +158,186 @@ def make_request(method, url, use_retry=True, **kwargs):
 def make_request_with_retry(method, url, **kwargs):
     return make_request(method, url, use_retry=True, **kwargs)
 
-def get_activecampaign_contacts_page(base_url, headers, params, use_retry=True):
+def get_activecampaign_base_url():
+    # ACTIVECAMPAIGN_API_URL points the sync at a full API root, e.g. a local stand-in server
+    api_url = os.environ.get("ACTIVECAMPAIGN_API_URL")
+    if api_url:
+        return api_url.rstrip('/')
+
+    base_url = os.environ.get("ACTIVECAMPAIGN_URL")
+    if not base_url.startswith("https://"):
+        base_url = f"https://{base_url}"
+    return base_url + ".api-us1.com/api/3"
+
+def get_activecampaign_headers():
+    return {
+        "Api-Token": os.environ.get("ACTIVECAMPAIGN_KEY"),
+        "Content-Type": "application/json"
+    }
+
+def group_by_contact(items):
+    """Group sideloaded or scanned AC records by their contact id."""
+    grouped = defaultdict(list)
+    for item in items:
+        grouped[str(item.get('contact'))].append(item)
+    return dict(grouped)
+
+def get_contact_link(base_url, contact, rel):
+    """Return the absolute URL of one of the contact's own links."""
+    href = (contact.get('links') or {}).get(rel)
+    if not href:
+        return None
+    return urljoin(f"{base_url}/", href)
+
+def enrich_contact(base_url, headers, contact, use_retry=True, deals_index=None, field_values_index=None):
+    """
+    Attach custom field values and deals to a single contact.
+    Prefetched indexes are used when given, otherwise the sub-resources are requested per contact.
+    """
+    if field_values_index is not None:
+        contact['custom_fields'] = field_values_index.get(str(contact['id']), [])
+    else:
+        field_values_link = get_contact_link(base_url, contact, 'fieldValues')
+        if field_values_link:
+            contact['custom_fields'] = get_contact_custom_fields(field_values_link, headers, use_retry)
+        else:
+            logger.warning(f"No fieldValues link found for contact {contact['id']}")
+            contact['custom_fields'] = []
+
+    # Attach deals from the prefetched index, falling back to one request per contact
+    if deals_index is not None:
+        contact['deals'] = deals_index.get(str(contact['id']), [])
+    else:
+        deals = get_contact_deals(base_url, headers, contact['id'], use_retry)
+        contact['deals'] = deals
+    return contact
+
+def fetch_activecampaign_contacts_page(base_url, headers, params, use_retry=True):
+    """
+    Fetch one page of contacts with their field values sideloaded (include=fieldValues).
+    Returns {'contacts': [...], 'field_values_index': {contact_id: [...]} or None}.
+    """
+    params = {**params, "include": "fieldValues"}
     try:
         if use_retry:
             response = make_request_with_retry('GET', f"{base_url}/contacts", headers=headers, params=params)
         else:
             response = make_request('GET', f"{base_url}/contacts", use_retry=False, headers=headers, params=params)
-        
-        if response is None:
-            return []
-        
-        contacts_data = response.json()
-        contacts = contacts_data.get("contacts", [])
-        
-        for contact in contacts:
-            # Fetch custom fields for each contact using the provided link
-            field_values_link = next((link['href'] for link in contacts_data.get('links', []) if link['rel'] == 'fieldValues'), None)
-            if field_values_link:
-                custom_fields = get_contact_custom_fields(field_values_link, headers, use_retry)
-                contact['custom_fields'] = custom_fields
-            else:
-                logger.warning(f"No fieldValues link found for contact {contact['id']}")
-                contact['custom_fields'] = []
-            
-            # Fetch deals for each contact
-            deals = get_contact_deals(base_url, headers, contact['id'], use_retry)
-            contact['deals'] = deals
-        
-        return contacts
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error retrieving contacts: {str(e)}")
+        response = None
+
+    if response is None:
+        return {'contacts': [], 'field_values_index': None, 'failed': True}
+
+    contacts_data = response.json()
+    field_values_index = None
+    if "fieldValues" in contacts_data:
+        field_values_index = group_by_contact(contacts_data["fieldValues"])
+    else:
+        logger.warning("fieldValues were not sideloaded, fetching them per contact")
+    return {'contacts': contacts_data.get("contacts", []), 'field_values_index': field_values_index}
+
+def enrich_activecampaign_contacts_page(base_url, headers, page, use_retry=True, executor=None, deals_index=None):
+    """
+    Attach custom fields and deals to the contacts of a fetched page.
+    When a deals index is given deals are attached from memory instead of fetched per contact.
+    Anything that still needs a per-contact request is fetched on the executor when one is given.
+    """
+    contacts = page['contacts']
+    field_values_index = page['field_values_index']
+    try:
+        if executor is not None and (field_values_index is None or deals_index is None):
+            futures = [
+                executor.submit(enrich_contact, base_url, headers, contact, use_retry, deals_index, field_values_index)
+                for contact in contacts
+            ]
+            for future in futures:
+                future.result()
+        else:
+            for contact in contacts:
+                enrich_contact(base_url, headers, contact, use_retry, deals_index, field_values_index)
     except requests.exceptions.RequestException as e:
         logger.error(f"Error retrieving contacts: {str(e)}")
         return []
+    return contacts
+
+def get_activecampaign_contacts_page(base_url, headers, params, use_retry=True, executor=None, deals_index=None):
+    """Fetch one page of contacts with their custom fields and deals."""
+    page = fetch_activecampaign_contacts_page(base_url, headers, params, use_retry)
+    return enrich_activecampaign_contacts_page(base_url, headers, page, use_retry, executor, deals_index)
+
+class KeysetPageParams:
+    """
+    Page params for id-ordered keyset pagination (orders[id]=ASC, id_greater=<last id seen>).
+    Each page depends on the previous one, so advance() must be called with every fetched
+    page before the next params are taken. Iteration stops after the first short (or empty)
+    page or once `limit` contacts have been fetched.
+    """
+
+    def __init__(self, filters=None, page_limit=100, limit=None, start_after_id=0):
+        self.filters = filters or {}
+        self.page_limit = page_limit
+        self.limit = limit
+        self.last_id = start_after_id
+        self.fetched = 0
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        return {**self.filters, "orders[id]": "ASC", "id_greater": self.last_id, "limit": self.page_limit}
+
+    def advance(self, page):
+        if page.get('failed'):
+            # An empty page here would look like the end of the walk
+            raise requests.exceptions.RequestException(f"Error retrieving contacts after id {self.last_id}")
+        contacts = page['contacts']
+        if not contacts:
+            self.done = True
+            return
+        self.last_id = max(int(contact['id']) for contact in contacts)
+        self.fetched += len(contacts)
+        if len(contacts) < self.page_limit or (self.limit and self.fetched >= self.limit):
+            self.done = True
+
+def process_activecampaign_contact_pages(base_url, headers, page_params, persist_page, concurrency=1, deals_index=None,
+                                        failed_pages=None):
+    """
+    Stream contact pages through the fetch -> enrich -> persist pipeline.
+    Up to `concurrency` pages are fetched at once and per-contact sub-requests share a pool
+    of the same size; the session's rate limiter still caps the overall requests per second.
+    persist_page(contacts) runs on the calling thread. Returns the per-stage stats.
+    Keyset page params are fetched one page at a time, as each page needs the previous one's last id.
+    A page that can't be fetched stops a keyset walk. Other pages are skipped and their params
+    appended to `failed_pages`; without that list they stop the run too.
+    """
+    keyset = isinstance(page_params, KeysetPageParams)
+
+    def fetch_page(params):
+        page = fetch_activecampaign_contacts_page(base_url, headers, params)
+        if keyset:
+            page_params.advance(page)
+        elif page.get('failed'):
+            if failed_pages is None:
+                raise requests.exceptions.RequestException(f"Error retrieving contacts with {params}")
+            failed_pages.append(params)
+        return page
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ac-enrich') as enrich_executor:
+        return run_pipeline(
+            page_params,
+            fetch_page=fetch_page,
+            enrich_page=lambda page: enrich_activecampaign_contacts_page(
+                base_url, headers, page, executor=enrich_executor if concurrency > 1 else None, deals_index=deals_index
+            ),
+            persist_page=persist_page,
+            fetch_workers=1 if keyset else concurrency,
+            queue_size=max(2, concurrency * 2),
+        )
 
 def get_contact_custom_fields(field_values_link, headers, use_retry=True):
     all_field_values = []
@@ -115,6 +365,57 @@ def get_contact_custom_fields(field_values_link, headers, use_retry=True):
 
     return all_field_values
 
+def get_activecampaign_collection(base_url, headers, endpoint, key, params=None, concurrency=1, page_limit=100, http_session=None):
+    """
+    Fetch every item of a paginated ActiveCampaign collection.
+    The first page reports the total; the remaining pages are fetched with up to
+    `concurrency` requests in flight and returned in order.
+    """
+    params = dict(params or {})
+
+    def fetch(offset):
+        response = make_request_with_retry(
+            'GET', f"{base_url}/{endpoint}", http_session=http_session, headers=headers,
+            params={**params, "limit": page_limit, "offset": offset}
+        )
+        return response.json().get(key, []) if response is not None else []
+
+    first_response = make_request_with_retry(
+        'GET', f"{base_url}/{endpoint}", http_session=http_session, headers=headers,
+        params={**params, "limit": page_limit, "offset": 0}
+    )
+    first_data = first_response.json()
+    items = list(first_data.get(key, []))
+
+    if "total" not in first_data.get("meta", {}):
+        # No total reported, keep paging until a short page comes back
+        offset = page_limit
+        page = items
+        while len(page) == page_limit:
+            page = fetch(offset)
+            items.extend(page)
+            offset += page_limit
+        return items
+
+    total = int(first_data["meta"]["total"])
+    offsets = range(page_limit, total, page_limit)
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'ac-{endpoint}') as executor:
+            for page in executor.map(fetch, offsets):
+                items.extend(page)
+    else:
+        for offset in offsets:
+            items.extend(fetch(offset))
+    return items
+
+def get_activecampaign_deals_index(base_url, headers, concurrency=1, updated_since=None):
+    """
+    Page through /deals once and index the deals by contact id.
+    With `updated_since` only deals modified after that time are fetched.
+    """
+    params = {AC_UPDATED_AFTER_FILTER: updated_since.isoformat()} if updated_since else None
+    return group_by_contact(get_activecampaign_collection(base_url, headers, 'deals', 'deals', params=params, concurrency=concurrency))
+
 def get_contact_deals(base_url, headers, contact_id, use_retry=True):
     try:
         if use_retry:
@@ -130,17 +431,88 @@ def get_contact_deals(base_url, headers, contact_id, use_retry=True):
         print(f"Error retrieving deals for contact {contact_id}: {str(e)}")
         return []
 
-def process_contact(contact):
+def payload_hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def deal_content_hash(deal):
+    """Hash of an AC deal, ignoring its API links."""
+    return payload_hash({k: v for k, v in deal.items() if k != 'links'})
+
+def contact_content_hash(contact):
+    """
+    Hash of an AC contact's own fields and custom field values, ignoring API links.
+    Deals are left out: they have their own content_hash, and a delta sync only sees the changed ones.
+    """
+    return payload_hash({
+        'contact': {k: v for k, v in contact.items() if k not in ('links', 'custom_fields', 'deals')},
+        'custom_fields': {str(field.get('field')): field.get('value') for field in contact.get('custom_fields', [])},
+    })
+
+def get_deal_pipeline_ac_id(deal):
+    return deal.get('pipeline') or deal.get('group') or deal.get('dealGroup')
+
+def build_custom_field(ac_id, field):
+    return CustomField(
+        ac_id=ac_id,
+        type=field.get('fieldType', ''),
+        ac_title=field.get('fieldTitle', ''),
+        ac_json=field
+    )
+
+def build_pipeline(ac_id, deal):
+    return PipeLine(
+        ac_id=ac_id,
+        name=deal.get('pipeline_title') or deal.get('group_title') or 'Unknown Pipeline',
+        ac_json=deal.get('pipeline', {})
+    )
+
+def build_deal_stage(ac_id, deal, pipeline_id):
+    return DealStage(
+        ac_id=ac_id,
+        name=deal.get('stage_title', 'Unknown Stage'),
+        pipeline_id=pipeline_id,
+        ac_json=deal.get('stage', {})
+    )
+
+def resolve_deal_stages(reference_ids, deals):
+    """
+    Stage primary keys for `deals`, keyed by AC stage id.
+    Pipelines are only resolved for stages the maps don't know yet.
+    """
+    stage_deals = {}
+    for deal in deals:
+        stage_deals.setdefault(deal.get('stage'), deal)
+
+    pipeline_deals = {}
+    for stage_ac_id, deal in stage_deals.items():
+        if stage_ac_id not in reference_ids['stages']:
+            pipeline_deals.setdefault(get_deal_pipeline_ac_id(deal), deal)
+    pipeline_ids = reference_ids.resolve('pipelines', pipeline_deals, build_pipeline)
+
+    return reference_ids.resolve(
+        'stages', stage_deals,
+        lambda ac_id, deal: build_deal_stage(ac_id, deal, pipeline_ids[get_deal_pipeline_ac_id(deal)])
+    )
+
+def process_contact(contact, reference_ids=None):
+    reference_ids = reference_ids if reference_ids is not None else ReferenceIds()
+    content_hash = contact_content_hash(contact)
+
     with transaction.atomic():
         # Lock the contact object for update
         contact_obj = Contact.objects.select_for_update().filter(ac_id=contact['id']).first()
         
+        if contact_obj and contact_obj.content_hash == content_hash:
+            # Nothing changed since the last sync, but its deals may have
+            write_contact_deals(contact_obj.id, contact.get('deals', []), reference_ids)
+            return contact_obj
+
         if contact_obj:
             # Update existing contact
             contact_obj.email = contact.get('email')
             contact_obj.first_name = contact.get('firstName')
             contact_obj.last_name = contact.get('lastName')
-            contact_obj.ac_json = json.dumps(contact)
+            contact_obj.content_hash = content_hash
             contact_obj.save()
         else:
             # Create new contact
@@ -149,173 +521,406 @@ def process_contact(contact):
                 email=contact.get('email'),
                 first_name=contact.get('firstName'),
                 last_name=contact.get('lastName'),
-                ac_json=json.dumps(contact)
+                content_hash=content_hash
             )
 
+        ContactRawPayload.from_contact(contact_obj.id, contact).save()
+        mark_contacts_dirty([contact_obj.id])
+
         # Process custom fields
+        custom_fields = {}
         for field in contact.get('custom_fields', []):
-            custom_field = CustomField.objects.select_for_update().get_or_create(
-                ac_id=field['field'],
-                defaults={
-                    'type': field.get('fieldType', ''),
-                    'ac_title': field.get('fieldTitle', ''),
-                    'ac_json': json.dumps(field)
-                }
-            )[0]
+            custom_fields.setdefault(str(field['field']), field)
+        custom_field_ids = reference_ids.resolve('custom_fields', custom_fields, build_custom_field)
 
+        for field in contact.get('custom_fields', []):
             ContactCustomField.objects.update_or_create(
                 contact=contact_obj,
-                custom_field=custom_field,
+                custom_field_id=custom_field_ids[str(field['field'])],
                 defaults={
                     'value': field.get('value', '')
                 }
             )
 
-        # Process deals
+        write_contact_deals(contact_obj.id, contact.get('deals', []), reference_ids)
+
+    return contact_obj
+
+def write_contact_deals(contact_id, deals, reference_ids):
+    """Update or create a contact's deals, skipping those whose content hash is unchanged"""
+    deal_hashes = {deal['id']: deal_content_hash(deal) for deal in deals}
+    stored_deal_hashes = dict(Deal.objects.filter(ac_id__in=deal_hashes).values_list('ac_id', 'content_hash'))
+    deals = [deal for deal in deals if stored_deal_hashes.get(str(deal['id'])) != deal_hashes[deal['id']]]
+
+    stage_ids = resolve_deal_stages(reference_ids, deals)
+    for deal in deals:
+        Deal.objects.update_or_create(
+            ac_id=deal['id'],
+            defaults={
+                'contact_id': contact_id,
+                'stage_id': stage_ids[deal.get('stage')],
+                'title': deal.get('title', 'Untitled Deal'),
+                'value': deal.get('value'),
+                'currency': deal.get('currency', 'USD'),
+                'created_date': parse_datetime(deal.get('cdate')),
+                'updated_date': parse_datetime(deal.get('mdate')),
+                'ac_json': deal,
+                'content_hash': deal_hashes[deal['id']]
+            }
+        )
+
+def bulk_upsert_contacts(contacts, reference_ids=None):
+    """
+    Write a page of contacts with their custom fields and deals in a handful of statements.
+    Produces the same rows as calling process_contact for each contact in order.
+    Contacts and deals whose content hash is unchanged are not written; a changed deal is
+    written even when its contact is unchanged.
+    Custom fields, pipelines and stages are resolved through `reference_ids` (a ReferenceIds,
+    loaded when not given), so known ones cost no queries.
+    Returns the number of contacts written.
+    """
+    # Later occurrences win, as they would with one update_or_create per contact
+    page_contacts = {str(contact['id']): contact for contact in contacts}
+    content_hashes = {ac_id: contact_content_hash(contact) for ac_id, contact in page_contacts.items()}
+
+    stored_hashes = dict(Contact.objects.filter(ac_id__in=page_contacts).values_list('ac_id', 'content_hash'))
+    contacts_by_ac_id = {
+        ac_id: contact for ac_id, contact in page_contacts.items()
+        if stored_hashes.get(ac_id) != content_hashes[ac_id]
+    }
+
+    deals = {}
+    for ac_id, contact in page_contacts.items():
         for deal in contact.get('deals', []):
-            # Fetch or create the pipeline
-            pipeline = PipeLine.objects.select_for_update().get_or_create(
-                ac_id=deal.get('pipeline') or deal.get('group') or deal.get('dealGroup'),
-                defaults={
-                    'name': deal.get('pipeline_title') or deal.get('group_title') or 'Unknown Pipeline',
-                    'ac_json': json.dumps(deal.get('pipeline', {}))
-                }
-            )[0]
+            deals[str(deal['id'])] = (ac_id, deal)
+    deal_hashes = {deal_ac_id: deal_content_hash(deal) for deal_ac_id, (ac_id, deal) in deals.items()}
+    stored_deal_hashes = dict(Deal.objects.filter(ac_id__in=deals).values_list('ac_id', 'content_hash'))
+    deals = {
+        deal_ac_id: (ac_id, deal) for deal_ac_id, (ac_id, deal) in deals.items()
+        if stored_deal_hashes.get(deal_ac_id) != deal_hashes[deal_ac_id]
+    }
 
-            # Fetch or create the deal stage
-            stage = DealStage.objects.select_for_update().get_or_create(
-                ac_id=deal.get('stage'),
-                defaults={
-                    'name': deal.get('stage_title', 'Unknown Stage'),
-                    'pipeline': pipeline,
-                    'ac_json': deal.get('stage', {})
-                }
-            )[0]
+    if not contacts_by_ac_id and not deals:
+        return 0
+    if reference_ids is None:
+        reference_ids = ReferenceIds.load()
 
-            Deal.objects.update_or_create(
-                ac_id=deal['id'],
-                defaults={
-                    'contact': contact_obj,
-                    'stage': stage,
-                    'title': deal.get('title', 'Untitled Deal'),
-                    'value': deal.get('value'),
-                    'currency': deal.get('currency', 'USD'),
-                    'created_date': parse_datetime(deal.get('cdate')),
-                    'updated_date': parse_datetime(deal.get('mdate')),
-                    'ac_json': json.dumps(deal)
-                }
+    bulk_upsert(
+        Contact,
+        [
+            Contact(
+                ac_id=ac_id,
+                email=contact.get('email'),
+                first_name=contact.get('firstName'),
+                last_name=contact.get('lastName'),
+                content_hash=content_hashes[ac_id]
             )
+            for ac_id, contact in contacts_by_ac_id.items()
+        ],
+        unique_fields=['ac_id'],
+        update_fields=['email', 'first_name', 'last_name', 'content_hash'],
+    )
+    # Unchanged contacts are looked up too, for their changed deals
+    contact_ids = dict(
+        Contact.objects.filter(ac_id__in={*contacts_by_ac_id, *(ac_id for ac_id, deal in deals.values())})
+        .values_list('ac_id', 'id')
+    )
+    bulk_upsert(
+        ContactRawPayload,
+        [ContactRawPayload.from_contact(contact_ids[ac_id], contact) for ac_id, contact in contacts_by_ac_id.items()],
+        unique_fields=['contact'],
+        update_fields=['data', 'compressed'],
+    )
+    mark_contacts_dirty(contact_ids[ac_id] for ac_id in contacts_by_ac_id)
 
-    return contact_obj
+    # Custom field definitions are only created, never updated, like get_or_create
+    custom_fields = {}
+    field_values = {}
+    for ac_id, contact in contacts_by_ac_id.items():
+        for field in contact.get('custom_fields', []):
+            field_ac_id = str(field['field'])
+            custom_fields.setdefault(field_ac_id, field)
+            field_values[(contact_ids[ac_id], field_ac_id)] = field.get('value', '')
+    custom_field_ids = reference_ids.resolve('custom_fields', custom_fields, build_custom_field)
 
-def get_and_process_activecampaign_contacts(limit=None):
-    base_url = os.environ.get("ACTIVECAMPAIGN_URL")
-    if not base_url.startswith("https://"):
-        base_url = f"https://{base_url}"
-    base_url += ".api-us1.com/api/3"
-    
-    api_key = os.environ.get("ACTIVECAMPAIGN_KEY")
-    
-    headers = {
-        "Api-Token": api_key,
-        "Content-Type": "application/json"
-    }
+    bulk_upsert(
+        ContactCustomField,
+        [
+            ContactCustomField(contact_id=contact_id, custom_field_id=custom_field_ids[field_ac_id], value=value)
+            for (contact_id, field_ac_id), value in field_values.items()
+        ],
+        unique_fields=['contact', 'custom_field'],
+        update_fields=['value'],
+    )
+
+    # Pipelines and stages are only created, never updated, like get_or_create
+    stage_ids = resolve_deal_stages(reference_ids, (deal for ac_id, deal in deals.values()))
+    bulk_upsert(
+        Deal,
+        [
+            Deal(
+                ac_id=deal_ac_id,
+                contact_id=contact_ids[ac_id],
+                stage_id=stage_ids[deal.get('stage')],
+                title=deal.get('title', 'Untitled Deal'),
+                value=deal.get('value'),
+                currency=deal.get('currency', 'USD'),
+                created_date=parse_datetime(deal.get('cdate')),
+                updated_date=parse_datetime(deal.get('mdate')),
+                ac_json=deal,
+                content_hash=deal_hashes[deal_ac_id]
+            )
+            for deal_ac_id, (ac_id, deal) in deals.items()
+        ],
+        unique_fields=['ac_id'],
+        update_fields=['contact', 'stage', 'title', 'value', 'currency', 'created_date', 'updated_date', 'ac_json', 'content_hash'],
+    )
+
+    return len(contacts_by_ac_id)
+
+def process_contacts(contacts, reference_ids=None):
+    """
+    Store a page of contacts with the bulk writer.
+    If the page fails as a whole it is retried one contact at a time so a single bad
+    record doesn't lose the rest of the page.
+    Returns (processed, changed) contact counts; contacts that could not be stored aren't processed.
+    """
+    if not contacts:
+        return 0, 0
+
+    try:
+        with transaction.atomic():
+            changed_contacts = bulk_upsert_contacts(contacts, reference_ids)
+        return len(contacts), changed_contacts
+    except Exception as e:
+        logger.warning(f"Bulk write of {len(contacts)} contacts failed, retrying one at a time: {e}")
+        if reference_ids is not None:
+            # A stale id (e.g. a stage deleted since the maps were loaded) fails the whole page
+            reference_ids.reload()
+
+    stored_hashes = dict(
+        Contact.objects.filter(ac_id__in=[str(contact['id']) for contact in contacts]).values_list('ac_id', 'content_hash')
+    )
+    processed_contacts = 0
+    changed_contacts = 0
+    for contact in contacts:
+        try:
+            process_contact(contact, reference_ids)
+            processed_contacts += 1
+            if stored_hashes.get(str(contact['id'])) != contact_content_hash(contact):
+                changed_contacts += 1
+        except Exception as e:
+            logger.error(f"Error processing contact: {e}")
+    return processed_contacts, changed_contacts
+
+def get_and_process_activecampaign_contacts(limit=None, concurrency=None, updated_since=None, pagination=None, sync_log=None, reference_ids=None):
+    """
+    Fetch ActiveCampaign contacts and store them locally.
+    `concurrency` sets how many requests are kept in flight (defaults to ACTIVECAMPAIGN_FETCH_CONCURRENCY).
+    With `updated_since` only contacts and deals modified after that time are fetched (delta sync).
+    `pagination` is 'keyset' or 'offset' (defaults to ACTIVECAMPAIGN_PAGINATION); only offset
+    pages are fetched concurrently.
+    Each page is committed on its own. With a `sync_log`, its counters and checkpoint are saved
+    after every page, and a keyset walk starts after the checkpointed contact id.
+    `reference_ids` is the ReferenceIds returned by sync_pipelines_and_stages; it is loaded
+    once for the run when not given.
+    Returns (processed, changed) contact counts.
+    """
+    base_url = get_activecampaign_base_url()
+    headers = get_activecampaign_headers()
+
+    concurrency = max(1, min(concurrency or AC_FETCH_CONCURRENCY, AC_MAX_FETCH_CONCURRENCY))
+    filters = {AC_UPDATED_AFTER_FILTER: updated_since.isoformat()} if updated_since else {}
     
     try:
-        initial_response = make_request('GET', f"{base_url}/contacts", headers=headers, params={"limit": 1})
+        initial_response = make_request('GET', f"{base_url}/contacts", headers=headers, params={**filters, "limit": 1})
         total_contacts = int(initial_response.json().get("meta", {}).get("total", 0))
     except requests.exceptions.RequestException as e:
         print(f"Error getting total contacts: {str(e)}")
-        return 0
+        return 0, 0
     
     if limit:
         total_contacts = min(limit, total_contacts)
     
     page_limit = 100  # Define the number of contacts per API request
-    num_pages = (total_contacts + page_limit - 1) // page_limit
+    keyset = (pagination or AC_PAGINATION) == 'keyset'
+    if keyset:
+        # The total only sizes the progress bar; the walk ends at the first short page
+        start_after_id = (sync_log.checkpoint_last_id or 0) if sync_log else 0
+        if start_after_id:
+            logger.warning(f"Resuming contacts after id {start_after_id}")
+        page_params = KeysetPageParams(filters, page_limit, limit, start_after_id)
+    else:
+        num_pages = (total_contacts + page_limit - 1) // page_limit
+        page_params = ({**filters, "limit": page_limit, "offset": i * page_limit} for i in range(num_pages))
+
+    # Scan /deals once up front instead of asking for every contact's deals
+    try:
+        deals_index = get_activecampaign_deals_index(base_url, headers, concurrency, updated_since)
+        logger.info(f"Prefetched deals for {len(deals_index)} contacts")
+    except (requests.exceptions.RequestException, RetryError) as e:
+        if updated_since:
+            # Without the deal scan a delta sync would miss deals changed on unchanged contacts
+            raise
+        logger.warning(f"Error prefetching deals, falling back to per-contact requests: {str(e)}")
+        deals_index = None
     
+    if reference_ids is None:
+        reference_ids = ReferenceIds.load()
+
     pbar = tqdm(total=total_contacts, desc="Processing contacts", unit="contact")
     
-    processed_contacts = 0
+    totals = {'processed': 0, 'changed': 0}
+    seen_contact_ids = set()
+
+    def persist_page(contacts, checkpoint=keyset):
+        processed, changed = process_contacts(contacts, reference_ids)
+        totals['processed'] += processed
+        totals['changed'] += changed
+        seen_contact_ids.update(str(contact['id']) for contact in contacts)
+        pbar.update(len(contacts))
+
+        if sync_log:
+            sync_log.contacts_attempted += processed
+            sync_log.contacts_changed += changed
+            sync_log.contacts_skipped += processed - changed
+            sync_log.contacts_ingest_failed += len(contacts) - processed
+            update_fields = ['contacts_attempted', 'contacts_changed', 'contacts_skipped', 'contacts_ingest_failed']
+            # Keyset pages are persisted in id order, so the page's last id is a safe resume point
+            if checkpoint and contacts:
+                sync_log.checkpoint_last_id = max(int(contact['id']) for contact in contacts)
+                update_fields.append('checkpoint_last_id')
+            sync_log.save(update_fields=update_fields)
     
-    for i in range(num_pages):
-        contacts = get_activecampaign_contacts_page(
-            base_url, 
-            headers, 
-            {"limit": page_limit, "offset": i * page_limit}
-        )
-        
-        for contact in contacts:
-            try:
-                processed_contact = process_contact(contact) 
-                processed_contacts += 1
-                pbar.update(1)
-            except Exception as e:
-                logger.error(f"Error processing contact: {e}")
-        
-        # Remove the break condition to allow processing all contacts
-        # if limit and processed_contacts >= limit:
-        #     break
+    failed_pages = []
+
+    def record_failed_pages():
+        # The contacts of a skipped page count as not stored, so the watermark is held back
+        failed = sum(len(params['ids'].split(',')) if 'ids' in params else params['limit'] for params in failed_pages)
+        if not failed:
+            return
+        logger.error(f"{len(failed_pages)} contact pages could not be fetched ({failed} contacts at most)")
+        failed_pages.clear()
+        if sync_log:
+            sync_log.contacts_ingest_failed += failed
+            sync_log.save(update_fields=['contacts_ingest_failed'])
+
+    # Pages are fetched and enriched on worker threads, but all database writes stay on this thread
+    stats = process_activecampaign_contact_pages(
+        base_url, headers, page_params, persist_page, concurrency, deals_index, failed_pages
+    )
+    record_failed_pages()
     
     pbar.close()
+
+    if updated_since and deals_index:
+        # Deals can change without their contact changing, so pick up those contacts by id
+        missing_ids = sorted(set(deals_index) - seen_contact_ids, key=int)
+        id_pages = (
+            {"ids": ",".join(missing_ids[i:i + page_limit]), "limit": page_limit}
+            for i in range(0, len(missing_ids), page_limit)
+        )
+        # These pages aren't part of the keyset walk, so they must not move its checkpoint
+        id_stats = process_activecampaign_contact_pages(
+            base_url, headers, id_pages, lambda contacts: persist_page(contacts, checkpoint=False), concurrency,
+            deals_index, failed_pages
+        )
+        record_failed_pages()
+        for stage, id_stage in zip(stats, id_stats):
+            stage.add(id_stage)
+
+    logger.info(
+        "Contact pipeline throughput (the stage with the most busy time is the bottleneck): "
+        + "; ".join(str(stage) for stage in stats)
+    )
     
-    return processed_contacts
+    return totals['processed'], totals['changed']
+
+def get_delta_watermark():
+    """
+    Return the time a delta sync should fetch changes from, or None when a full sync is due:
+    there is no successful sync yet, or the last full sync is older than FULL_SYNC_INTERVAL.
+    """
+    last_full = SyncLog.objects.filter(sync_type='full', watermark__isnull=False).order_by('-watermark').first()
+    if not last_full or timezone.now() - last_full.watermark > FULL_SYNC_INTERVAL:
+        return None
+
+    last_sync = SyncLog.objects.filter(watermark__isnull=False).order_by('-watermark').first()
+    return last_sync.watermark - DELTA_SYNC_OVERLAP
 
 def get_activecampaign_pipelines(base_url, headers):
-    response = make_request('GET', f"{base_url}/dealGroups", headers=headers)
-    if response.status_code == 200:
-        return response.json().get("dealGroups", [])
-    else:
-        print(f"Error retrieving pipelines: {response.status_code}")
-        print(response.text)
-        return []
+    return get_activecampaign_collection(base_url, headers, 'dealGroups', 'dealGroups', http_session=reference_session)
 
-def get_activecampaign_stages(base_url, headers, pipeline_id):
-    response = make_request('GET', f"{base_url}/dealStages?filters[group]={pipeline_id}", headers=headers)
-    if response.status_code == 200:
-        return response.json().get("dealStages", [])
-    else:
-        print(f"Error retrieving stages for pipeline {pipeline_id}: {response.status_code}")
-        print(response.text)
-        return []
+def get_activecampaign_deal_stages(base_url, headers):
+    """Every deal stage of every pipeline, from a single scan of /dealStages"""
+    return get_activecampaign_collection(base_url, headers, 'dealStages', 'dealStages', http_session=reference_session)
 
-def sync_pipelines_and_stages(base_url, headers):
+def sync_pipelines_and_stages(base_url, headers, reference_ids=None):
+    """
+    Mirror AC pipelines and deal stages locally, creating or updating them in bulk.
+    Returns `reference_ids` (a ReferenceIds, loaded when not given) with the pipelines and
+    stages added, for the ingest to reuse.
+    """
+    if reference_ids is None:
+        reference_ids = ReferenceIds.load()
     pipelines = get_activecampaign_pipelines(base_url, headers)
-    
-    for pipeline in pipelines:
-        with transaction.atomic():
-            pipeline_obj, created = PipeLine.objects.update_or_create(
-                ac_id=pipeline['id'],
-                defaults={
-                    'name': pipeline['title'],
-                    'ac_json': pipeline
-                }
-            )
-            
-            print(f"{'Created' if created else 'Updated'} pipeline: {pipeline_obj.name}")
-            
-            stages = get_activecampaign_stages(base_url, headers, pipeline['id'])
-            for stage in stages:
-                stage_obj, stage_created = DealStage.objects.update_or_create(
+    stages = get_activecampaign_deal_stages(base_url, headers)
+
+    with transaction.atomic():
+        PipeLine.objects.bulk_create(
+            [PipeLine(ac_id=pipeline['id'], name=pipeline['title'], ac_json=pipeline) for pipeline in pipelines],
+            update_conflicts=True,
+            unique_fields=['ac_id'],
+            update_fields=['name', 'ac_json'],
+        )
+        pipeline_ids = dict(PipeLine.objects.values_list('ac_id', 'id'))
+
+        DealStage.objects.bulk_create(
+            [
+                DealStage(
                     ac_id=stage['id'],
-                    defaults={
-                        'name': stage['title'],
-                        'order': stage['order'],
-                        'pipeline': pipeline_obj,
-                        'ac_json': stage
-                    }
+                    name=stage['title'],
+                    order=stage['order'],
+                    pipeline_id=pipeline_ids.get(str(stage.get('group'))),
+                    ac_json=stage
                 )
-                print(f"{'Created' if stage_created else 'Updated'} stage: {stage_obj.name}")
+                for stage in stages
+            ],
+            update_conflicts=True,
+            unique_fields=['ac_id'],
+            update_fields=['name', 'order', 'pipeline', 'ac_json'],
+        )
+        reference_ids.remember('pipelines', pipeline_ids)
+        reference_ids.remember('stages', dict(DealStage.objects.values_list('ac_id', 'id')))
 
+    print(f"Synced {len(pipelines)} pipelines and {len(stages)} stages")
+    return reference_ids
+
+
+def sync_custom_field_definitions(base_url, headers, reference_ids=None):
+    """
+    Store AC custom field definitions (title and type), which field values don't carry.
+    Fields are created or updated in bulk from one scan of /fields and added to `reference_ids`.
+    """
+    fields = get_activecampaign_collection(base_url, headers, 'fields', 'fields', http_session=reference_session)
+
+    with transaction.atomic():
+        CustomField.objects.bulk_create(
+            [
+                CustomField(ac_id=field['id'], type=field.get('type', ''), ac_title=field.get('title', ''), ac_json=field)
+                for field in fields
+            ],
+            update_conflicts=True,
+            unique_fields=['ac_id'],
+            update_fields=['type', 'ac_title', 'ac_json'],
+        )
+        if reference_ids is not None:
+            reference_ids.remember('custom_fields', dict(CustomField.objects.values_list('ac_id', 'id')))
+
+    print(f"Synced {len(fields)} custom field definitions")
 
 def get_contact_from_highlevel(contact_id):
-    url = f"https://rest.gohighlevel.com/v1/contacts/{contact_id}"
-    headers = {
-        "Authorization": f"Bearer {os.environ.get('HIGHLEVEL_API_KEY')}",
-        "Content-Type": "application/json"
-    }
-    
-    response = requests.get(url, headers=headers)
+    response = get_client().get(f"contacts/{contact_id}")
     
     if response.status_code == 200:
         print(response.json())  # Add this line to print the full response
@@ -325,62 +930,117 @@ def get_contact_from_highlevel(contact_id):
         return None
 
 
+SYNC_PHASES = ['pipelines', 'contacts', 'push']
+
+def get_resumable_sync_log(resume):
+    """
+    The SyncLog to resume: the given id, or with resume=True the latest failed or
+    interrupted run that reached a checkpoint. Returns None when there is nothing to resume.
+    """
+    if resume is True:
+        return (
+            SyncLog.objects.filter(status__in=['Failed', 'Interrupted'], checkpoint_phase__isnull=False)
+            .order_by('-start_time')
+            .first()
+        )
+    return SyncLog.objects.filter(id=resume).first()
+
 @shared_task(name='sync.run_sync_script')
-def run():
+def run(concurrency=None, full=False, resume=False):
     """
     Run the sync process.
+    `concurrency` overrides ACTIVECAMPAIGN_FETCH_CONCURRENCY for this run. With the default keyset
+    pagination contact pages are still fetched one at a time, so it only speeds up the /deals scan
+    and per-contact sub-requests; set ACTIVECAMPAIGN_PAGINATION=offset to fetch pages concurrently.
+    Only changes since the last successful sync are fetched unless `full` is set
+    or a scheduled full sync is due.
+    Progress is committed page by page and checkpointed on the SyncLog; `resume` (True for
+    the latest failed run, or a SyncLog id) continues a run from its checkpoint, and a new
+    run starts when there is nothing to resume.
     """
-    sync_log = SyncLog.objects.create(status='In Progress', start_time=timezone.now())
+    sync_log = get_resumable_sync_log(resume) if resume else None
+    if sync_log:
+        updated_since = sync_log.updated_since
+        sync_log.status = 'In Progress'
+        sync_log.error_message = None
+        sync_log.end_time = None
+        sync_log.save(update_fields=['status', 'error_message', 'end_time'])
+        logger.warning(f"Resuming sync {sync_log.id} from phase {sync_log.checkpoint_phase}")
+    else:
+        updated_since = None if full else get_delta_watermark()
+        sync_log = SyncLog.objects.create(
+            status='In Progress',
+            start_time=timezone.now(),
+            sync_type='delta' if updated_since else 'full',
+            updated_since=updated_since,
+        )
+
+    def reached(phase):
+        return sync_log.checkpoint_phase and SYNC_PHASES.index(sync_log.checkpoint_phase) > SYNC_PHASES.index(phase)
+
+    def start_phase(phase):
+        if sync_log.checkpoint_phase != phase:
+            sync_log.checkpoint_phase = phase
+            sync_log.save(update_fields=['checkpoint_phase'])
 
     try:
-        with transaction.atomic():
-            logger.setLevel(logging.WARNING)
+        # Check HighLevel API connection
+        logger.info("Checking HighLevel API connection...")
+        if not check_api_connection():
+            raise Exception("HighLevel API connection failed.")
 
-            # Check HighLevel API connection
-            logger.info("Checking HighLevel API connection...")
-            if not check_api_connection():
-                raise Exception("HighLevel API connection failed.")
+        logger.info("HighLevel API connection successful. Proceeding with sync process.")
 
-            logger.info("HighLevel API connection successful. Proceeding with sync process.")
+        base_url = get_activecampaign_base_url()
+        headers = get_activecampaign_headers()
 
-            base_url = os.environ.get("ACTIVECAMPAIGN_URL")
-            if not base_url.startswith("https://"):
-                base_url = f"https://{base_url}"
-            base_url += ".api-us1.com/api/3"
-            
-            api_key = os.environ.get("ACTIVECAMPAIGN_KEY")
-            
-            headers = {
-                "Api-Token": api_key,
-                "Content-Type": "application/json"
-            }
+        # AC id -> primary key maps shared by the pipelines sync and the contact ingest
+        reference_ids = ReferenceIds.load()
 
-            # Step 1: Sync pipelines and stages
-            logger.info("Syncing pipelines and stages...")
-            sync_pipelines_and_stages(base_url, headers)
+        # Step 1: Sync pipelines, stages and custom field definitions
+        if not reached('pipelines'):
+            start_phase('pipelines')
+            logger.info("Syncing pipelines, stages and custom field definitions...")
+            sync_pipelines_and_stages(base_url, headers, reference_ids)
+            sync_custom_field_definitions(base_url, headers, reference_ids)
             logger.info("Pipelines and stages sync completed.")
 
-            # Step 2-3: Process contacts, deals, and custom fields
-            logger.info("Processing contacts, deals, and custom fields...")
-            processed_contacts = get_and_process_activecampaign_contacts()
-            
-            sync_log.contacts_attempted = processed_contacts
-            final_count = Contact.objects.count()
-            logger.info(f"\nProcessed and stored {processed_contacts} contacts from ActiveCampaign")
-            logger.info(f"Total contacts in database: {final_count}")
-
-            # Schedule individual contact syncs to HighLevel
-            logger.info("\nScheduling contact syncs to HighLevel...")
-            contacts = Contact.objects.all()
-            for contact in contacts:
-                sync_contact_to_highlevel_task.delay(contact.id)
+        # Step 2-3: Process contacts, deals, and custom fields, committing page by page
+        if not reached('contacts'):
+            start_phase('contacts')
+            if updated_since:
+                logger.info(f"Processing contacts, deals, and custom fields changed since {updated_since}...")
+            else:
+                logger.info("Processing all contacts, deals, and custom fields...")
+            processed_contacts, changed_contacts = get_and_process_activecampaign_contacts(
+                concurrency=concurrency, updated_since=updated_since, sync_log=sync_log, reference_ids=reference_ids
+            )
+            logger.info(f"\nProcessed {processed_contacts} contacts from ActiveCampaign, {changed_contacts} changed")
 
-            sync_log.contacts_synced = contacts.count()
-            sync_log.status = 'Sync Tasks Scheduled'
-            sync_log.end_time = timezone.now()
-            sync_log.save()
+        # Give new custom fields their HighLevel ids so pushes can fill them in
+        logger.info("Mapping custom fields to HighLevel...")
+        sync_highlevel_custom_fields()
+
+        # Refresh the directory of existing HighLevel contacts so pushes update them instead of creating duplicates
+        logger.info("Refreshing the HighLevel contact directory...")
+        import_highlevel_contacts_if_stale()
 
-            logger.info("\nContact sync tasks scheduled.")
+        # Push only the contacts recorded in the outbox; the log is saved first so the
+        # chord callback's totals aren't overwritten
+        sync_log.checkpoint_phase = 'push'
+        sync_log.status = 'Sync Tasks Scheduled'
+        sync_log.end_time = timezone.now()
+        if sync_log.contacts_ingest_failed:
+            # Leave the watermark unset so the next delta sync fetches the failed contacts again
+            logger.error(f"{sync_log.contacts_ingest_failed} contacts could not be stored, not advancing the watermark")
+        else:
+            sync_log.watermark = sync_log.start_time
+        sync_log.save()
+
+        logger.info("\nScheduling contact syncs to HighLevel...")
+        drain_highlevel_outbox_task.delay(sync_log.id)
+
+        logger.info("\nContact sync tasks scheduled.")
     except Exception as e:
         sync_log.status = 'Failed'
         sync_log.error_message = str(e)
@@ -394,6 +1054,255 @@ def run():
             sync_log.end_time = timezone.now()
             sync_log.save()
 
+def chunk_ids(ids, chunk_size):
+    """Split ids (any iterable) into lists of `chunk_size`"""
+    ids = iter(ids)
+    return list(iter(lambda: list(islice(ids, chunk_size)), []))
+
+def next_id_window(queryset, field, after_id):
+    """
+    The next window of a keyset walk: up to HIGHLEVEL_PUSH_WINDOW_CHUNKS chunks' worth of
+    `field` values above `after_id`, ascending.
+    """
+    window_size = HIGHLEVEL_PUSH_CHUNK_SIZE * HIGHLEVEL_PUSH_WINDOW_CHUNKS
+    return list(
+        queryset.filter(**{f'{field}__gt': after_id}).order_by(field).values_list(field, flat=True)[:window_size]
+    )
+
+def add_push_counts(sync_log_id, results, synced_field, failed_field):
+    """
+    Add the synced and failed counts of finished chunks to the SyncLog.
+    With SQLITE_SINGLE_WRITER the update goes to the writer queue like the chunks' own writes.
+    """
+    writes = WriteBuffer()
+    writes.increment(SyncLog, sync_log_id, {
+        synced_field: sum(result['synced'] for result in results),
+        failed_field: sum(result['failed'] for result in results),
+    })
+    writes.flush()
+
+def get_pending_outbox(drained_at):
+    return HighLevelOutbox.objects.filter(processed_at__isnull=True, created_at__lte=parse_datetime(drained_at))
+
+def schedule_highlevel_sync(sync_log_id, drained_at, after_id=0):
+    """
+    Push the next window of outbox contacts (ids above `after_id`, pending as of `drained_at`)
+    to HighLevel, one Celery task per chunk of HIGHLEVEL_PUSH_CHUNK_SIZE.
+    The window's chord callback adds its counts to the SyncLog and schedules the next window,
+    so only one window of ids is held in memory and in the broker at a time. Once no contacts
+    are left the contact push is finalized.
+    Returns the number of contacts scheduled in this window.
+    """
+    contact_ids = next_id_window(get_pending_outbox(drained_at), 'contact_id', after_id)
+    if not contact_ids:
+        finalize_highlevel_sync_task.delay([], sync_log_id)
+        return 0
+
+    chunks = chunk_ids(contact_ids, HIGHLEVEL_PUSH_CHUNK_SIZE)
+    logger.info(f"Scheduling {len(contact_ids)} contacts in {len(chunks)} chunks")
+    chord(
+        group(sync_contacts_to_highlevel_task.s(chunk, drained_at) for chunk in chunks)
+    )(continue_highlevel_sync_task.s(sync_log_id, drained_at, contact_ids[-1]))
+    return len(contact_ids)
+
+@shared_task(name='sync.continue_highlevel_sync_task')
+def continue_highlevel_sync_task(results, sync_log_id, drained_at, after_id):
+    """Chord callback of a contact window: record its counts and schedule the next window"""
+    add_push_counts(sync_log_id, results, 'contacts_synced', 'contacts_failed')
+    schedule_highlevel_sync(sync_log_id, drained_at, after_id)
+
+@shared_task(name='sync.drain_highlevel_outbox_task')
+def drain_highlevel_outbox_task(sync_log_id=None):
+    """
+    Push every contact pending in the outbox to HighLevel in chunks, a window at a time.
+    Without a sync_log_id a new SyncLog is created for the push.
+    """
+    if sync_log_id is None:
+        sync_log_id = SyncLog.objects.create(status='Sync Tasks Scheduled', sync_type='push').id
+    # Counted again from scratch, e.g. when a resumed run pushes again
+    SyncLog.objects.filter(id=sync_log_id).update(contacts_synced=0, contacts_failed=0)
+
+    scheduled = schedule_highlevel_sync(sync_log_id, timezone.now().isoformat())
+    logger.info(f"Draining the HighLevel outbox, {scheduled} contacts in the first window")
+
+@shared_task(name='sync.sync_contacts_to_highlevel_task')
+def sync_contacts_to_highlevel_task(contact_ids, drained_at=None):
+    """
+    Sync a chunk of contacts to HighLevel.
+    With `drained_at`, outbox entries of pushed contacts that haven't changed since then are marked done.
+    With SQLITE_SINGLE_WRITER the chunk's database updates go to the writer queue in batches,
+    one per contact created in HighLevel and one at the end of the chunk.
+    Returns the number of contacts synced, skipped and failed.
+    """
+    writes = WriteBuffer() if single_writer_enabled() else None
+    counts = {'synced': 0, 'skipped': 0, 'failed': 0}
+    try:
+        payloads = build_highlevel_payloads(contact_ids)
+        # Contacts deleted since they were scheduled count as skipped
+        counts['skipped'] += len(contact_ids) - len(payloads)
+        # Contacts that already exist in HighLevel are updated instead of created
+        resolve_hl_ids_from_directory(
+            [contact for contact, payload in payloads if contact.needs_highlevel_sync()]
+        )
+        done_ids = []
+        for contact, payload in payloads:
+            try:
+                sync_result = sync_contact_to_highlevel(contact, payload=payload, lookup_directory=False, writes=writes)
+            except Exception as e:
+                logger.error(f"Failed to sync contact {contact.id} to HighLevel: {str(e)}")
+                counts['failed'] += 1
+                continue
+
+            if not sync_result.success:
+                counts['failed'] += 1
+                continue
+            elif sync_result.action == 'skipped':
+                counts['skipped'] += 1
+            else:
+                counts['synced'] += 1
+            if writes is not None and sync_result.action == 'created':
+                writes.flush()
+            done_ids.append(contact.id)
+
+        if drained_at and done_ids:
+            # Contacts changed again while being pushed stay dirty for the next drain
+            if writes is not None:
+                writes.mark_outbox_processed(done_ids, drained_at)
+            else:
+                HighLevelOutbox.objects.filter(
+                    contact_id__in=done_ids, processed_at__isnull=True, created_at__lte=parse_datetime(drained_at)
+                ).update(processed_at=timezone.now())
+        if writes is not None:
+            writes.flush()
+    except Exception as e:
+        # The window's chord only moves on once every chunk returns, so the rest of the chunk counts as failed
+        logger.error(f"Failed to sync contact chunk to HighLevel: {str(e)}")
+        counts['failed'] = len(contact_ids) - counts['synced'] - counts['skipped']
+    return counts
+
+@shared_task(name='sync.import_highlevel_contacts_task')
+def import_highlevel_contacts_task():
+    """Re-import the HighLevel contact directory used to match contacts by email"""
+    return import_highlevel_contacts()
+
+@shared_task(name='sync.finalize_highlevel_sync_task')
+def finalize_highlevel_sync_task(results, sync_log_id):
+    """
+    Record the counts of any last chunks on the SyncLog, then push the deals now that their
+    contacts exist in HighLevel.
+    """
+    add_push_counts(sync_log_id, results, 'contacts_synced', 'contacts_failed')
+    sync_log = SyncLog.objects.get(id=sync_log_id)
+    sync_log.status = 'Pushing Deals'
+    sync_log.save(update_fields=['status'])
+    logger.info(f"HighLevel contact sync finished: {sync_log.contacts_synced} synced, {sync_log.contacts_failed} failed")
+    if single_writer_enabled():
+        # Queued behind the chunks' write batches, so the contacts' hl_ids are saved before deals need them
+        start_deal_push_task.apply_async(args=[sync_log_id], queue=get_writer_queue())
+    else:
+        push_deals_to_highlevel_task.delay(sync_log_id)
+
+@shared_task(name='sync.start_deal_push_task')
+def start_deal_push_task(sync_log_id):
+    """
+    Runs on the writer queue only to order the deal push after the contacts' write batches;
+    the push itself, with its HighLevel requests, runs on the default queue.
+    """
+    push_deals_to_highlevel_task.delay(sync_log_id)
+
+@shared_task(name='sync.push_deals_to_highlevel_task')
+def push_deals_to_highlevel_task(sync_log_id=None):
+    """
+    Push changed deals to HighLevel as opportunities in chunks, one Celery task per chunk,
+    a window at a time like the contacts.
+    HighLevel pipelines and stages are refreshed first so new AC stages get linked.
+    """
+    if sync_log_id is None:
+        sync_log_id = SyncLog.objects.create(status='Pushing Deals', sync_type='push').id
+    SyncLog.objects.filter(id=sync_log_id).update(deals_synced=0, deals_failed=0)
+
+    try:
+        sync_highlevel_pipelines()
+        schedule_deal_push(sync_log_id)
+    except Exception as e:
+        logger.error(f"HighLevel deal push failed: {e}")
+        SyncLog.objects.filter(id=sync_log_id).update(status='Failed', error_message=str(e), end_time=timezone.now())
+
+def schedule_deal_push(sync_log_id, after_id=0):
+    """
+    Push the next window of changed deals (ids above `after_id`), one Celery task per chunk;
+    see schedule_highlevel_sync. Returns the number of deals scheduled in this window.
+    """
+    deal_ids = next_id_window(get_deals_to_push(), 'id', after_id)
+    if not deal_ids:
+        finalize_highlevel_deal_sync_task.delay([], sync_log_id)
+        return 0
+
+    chunks = chunk_ids(deal_ids, HIGHLEVEL_PUSH_CHUNK_SIZE)
+    logger.info(f"Scheduling {len(deal_ids)} deals in {len(chunks)} chunks")
+    chord(
+        group(sync_deals_to_highlevel_task.s(chunk) for chunk in chunks)
+    )(continue_deal_push_task.s(sync_log_id, deal_ids[-1]))
+    return len(deal_ids)
+
+@shared_task(name='sync.continue_deal_push_task')
+def continue_deal_push_task(results, sync_log_id, after_id):
+    """Chord callback of a deal window: record its counts and schedule the next window"""
+    add_push_counts(sync_log_id, results, 'deals_synced', 'deals_failed')
+    schedule_deal_push(sync_log_id, after_id)
+
+@shared_task(name='sync.sync_deals_to_highlevel_task')
+def sync_deals_to_highlevel_task(deal_ids):
+    """
+    Push a chunk of deals to HighLevel.
+    With SQLITE_SINGLE_WRITER the chunk's database updates go to the writer queue in batches,
+    one per opportunity created in HighLevel and one at the end of the chunk.
+    Returns the number of deals synced, skipped and failed.
+    """
+    writes = WriteBuffer() if single_writer_enabled() else None
+    counts = {'synced': 0, 'skipped': 0, 'failed': 0}
+    try:
+        deals = (
+            Deal.objects.filter(id__in=deal_ids)
+            .select_related('contact', 'stage__hl_dealstage__hl_pipeline')
+            .order_by('id')
+        )
+        for deal in deals:
+            try:
+                sync_result = sync_deal_to_highlevel(deal, writes=writes)
+            except Exception as e:
+                logger.error(f"Failed to sync deal {deal.id} to HighLevel: {str(e)}")
+                counts['failed'] += 1
+                continue
+
+            if not sync_result.success:
+                counts['failed'] += 1
+            elif sync_result.action == 'skipped':
+                counts['skipped'] += 1
+            else:
+                counts['synced'] += 1
+            if writes is not None and sync_result.action == 'created':
+                writes.flush()
+        # Deals deleted since they were scheduled count as skipped
+        counts['skipped'] += len(deal_ids) - sum(counts.values())
+        if writes is not None:
+            writes.flush()
+    except Exception as e:
+        # The window's chord only moves on once every chunk returns, so the rest of the chunk counts as failed
+        logger.error(f"Failed to sync deal chunk to HighLevel: {str(e)}")
+        counts['failed'] = len(deal_ids) - counts['synced'] - counts['skipped']
+    return counts
+
+@shared_task(name='sync.finalize_highlevel_deal_sync_task')
+def finalize_highlevel_deal_sync_task(results, sync_log_id):
+    """Record the counts of any last deal chunks on the SyncLog and complete it."""
+    add_push_counts(sync_log_id, results, 'deals_synced', 'deals_failed')
+    sync_log = SyncLog.objects.get(id=sync_log_id)
+    sync_log.status = 'Completed'
+    sync_log.end_time = timezone.now()
+    sync_log.save(update_fields=['status', 'end_time'])
+    logger.info(f"HighLevel deal sync finished: {sync_log.deals_synced} synced, {sync_log.deals_failed} failed")
+
 @shared_task(name='sync.sync_contact_to_highlevel_task')
 def sync_contact_to_highlevel_task(contact_id):
     """
@@ -404,7 +1313,13 @@ def sync_contact_to_highlevel_task(contact_id):
         contact = Contact.objects.get(id=contact_id)
         # Use the imported function from highlevel_sync
         sync_result = sync_contact_to_highlevel(contact)
-        logger.info(f"Successfully synced contact {contact_id} to HighLevel")
     except Exception as e:
         logger.error(f"Failed to sync contact {contact_id} to HighLevel: {str(e)}")
+        return {'contact_id': contact_id, 'action': 'failed', 'error': str(e)}
+
+    if sync_result.success:
+        logger.info(f"Successfully synced contact {contact_id} to HighLevel ({sync_result.action})")
+    else:
+        logger.error(f"Failed to sync contact {contact_id} to HighLevel: {sync_result.status_code} {sync_result.error}")
+    return sync_result.to_dict()
 
@@ -1,3 +1,1044 @@
-from django.test import TestCase
+import itertools
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import redis
+import requests
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from sync.highlevel_sync import (
+    HL_MAX_RETRY_WAIT, HighLevelClient, SyncResult, build_highlevel_payloads, build_opportunity_payload,
+    get_custom_field_hl_ids, get_deals_to_push, import_highlevel_contacts_if_stale, mark_contacts_dirty,
+    record_highlevel_contacts, sync_all_contacts_to_highlevel, sync_contact_to_highlevel, sync_deal_to_highlevel,
+    sync_highlevel_custom_fields, sync_highlevel_pipelines
+)
+from sync.bulk_load import bulk_upsert, use_copy_load
+from sync.models import (
+    Contact, ContactCustomField, ContactRawPayload, CustomField, Deal, DealStage, HighLevelOutbox, HLContact, HLDealstage,
+    HLPipeline, PipeLine, SyncLog
+)
+from sync.pipeline import run_pipeline
+from sync.rate_limit import REDIS_RETRY_INTERVAL, SharedRateLimiter, TokenBucket, get_retry_after, parse_rate_limit_headers
+from sync.reference_ids import ReferenceIds
+from sync.scripts import sync as sync_script
+from sync.write_queue import WriteBuffer, apply_writes
+
+
+class BuildHighLevelPayloadsTests(TestCase):
+    def setUp(self):
+        fields = [CustomField.objects.create(ac_id=str(i), type='text', ac_title=f'Field {i}', hl_id=f'hl{i}') for i in range(3)]
+        fields.append(CustomField.objects.create(ac_id='3', type='text', ac_title='Unmapped'))
+        self.contact_ids = []
+        for i in range(20):
+            contact = Contact.objects.create(ac_id=str(i), email=f'c{i}@example.com', first_name=f'First{i}', last_name='Last')
+            for field in fields:
+                ContactCustomField.objects.create(contact=contact, custom_field=field, value=f'{i}-{field.ac_id}')
+            self.contact_ids.append(contact.id)
+
+    def test_query_count_is_constant(self):
+        get_custom_field_hl_ids(reload=True)
+        with self.assertNumQueries(2):
+            payloads = build_highlevel_payloads(self.contact_ids)
+
+        self.assertEqual(len(payloads), 20)
+        contact, payload = payloads[0]
+        self.assertEqual(contact.id, self.contact_ids[0])
+        self.assertEqual(payload, {
+            'firstName': 'First0',
+            'lastName': 'Last',
+            'email': 'c0@example.com',
+            'customField': {'hl0': '0-0', 'hl1': '0-1', 'hl2': '0-2'},
+        })
+
+    def test_missing_contacts_are_left_out(self):
+        payloads = build_highlevel_payloads(self.contact_ids[:2] + [0])
+        self.assertEqual([contact.id for contact, payload in payloads], self.contact_ids[:2])
+
+
+class SyncHighLevelCustomFieldsTests(TestCase):
+    def test_contacts_with_values_for_newly_mapped_fields_are_pushed_again(self):
+        field = CustomField.objects.create(ac_id='1', type='text', ac_title='Favourite Colour')
+        other_field = CustomField.objects.create(ac_id='2', type='text', ac_title='Other', hl_id='hl-other')
+        with_value, without_value = [
+            Contact.objects.create(ac_id=str(i), email=f'c{i}@example.com', first_name='C', last_name='C',
+                                   content_hash='h', hl_synced_hash='h')
+            for i in range(2)
+        ]
+        ContactCustomField.objects.create(contact=with_value, custom_field=field, value='blue')
+        ContactCustomField.objects.create(contact=without_value, custom_field=other_field, value='x')
+        client = mock.Mock()
+        client.get.return_value = mock.Mock(status_code=200, json=lambda: {'customFields': [{'name': 'favourite colour', 'id': 'hl-1'}]})
+
+        with mock.patch('sync.highlevel_sync.get_client', return_value=client):
+            self.assertEqual(sync_highlevel_custom_fields(), 1)
+
+        self.assertEqual(CustomField.objects.get(id=field.id).hl_id, 'hl-1')
+        self.assertEqual(list(Contact.objects.filter(hl_synced_hash__isnull=True)), [with_value])
+        self.assertEqual(list(HighLevelOutbox.objects.values_list('contact_id', flat=True)), [with_value.id])
+
+
+class HighLevelDirectoryImportTests(TestCase):
+    def setUp(self):
+        pages = [
+            {'contacts': [{'id': 'a', 'email': 'A@example.com'}], 'meta': {'nextPageUrl': 'next', 'startAfterId': 'a'}},
+            {'contacts': [{'id': 'b', 'email': 'b@example.com'}], 'meta': {}},
+        ]
+        self.client = mock.Mock()
+        self.client.get.side_effect = lambda path, params: mock.Mock(status_code=200, json=lambda: pages[len(params) - 1])
+        patcher = mock.patch('sync.highlevel_sync.get_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_completed_import_keeps_the_directory_fresh(self):
+        self.assertEqual(import_highlevel_contacts_if_stale(), 2)
+        self.assertEqual(SyncLog.objects.get(sync_type='directory').status, 'Completed')
+        self.assertEqual(import_highlevel_contacts_if_stale(), 0)
+        self.assertEqual(self.client.get.call_count, 2)
+
+    def test_partial_import_is_imported_again(self):
+        first_page = self.client.get.side_effect
+        self.client.get.side_effect = lambda path, params: (
+            first_page(path, params) if len(params) == 1 else mock.Mock(status_code=500, text='error')
+        )
+        with self.assertRaises(Exception):
+            import_highlevel_contacts_if_stale()
+        self.assertEqual(SyncLog.objects.get(sync_type='directory').status, 'Failed')
+        self.assertTrue(HLContact.objects.filter(hl_id='a').exists())
+
+        self.client.get.side_effect = first_page
+        self.assertEqual(import_highlevel_contacts_if_stale(), 2)
+
+    def test_contacts_recorded_by_pushes_dont_count_as_an_import(self):
+        record_highlevel_contacts([{'id': 'c', 'email': 'c@example.com'}])
+        self.assertEqual(import_highlevel_contacts_if_stale(), 2)
+
+        imported_at = HLContact.objects.get(hl_id='a').imported_at
+        record_highlevel_contacts([{'id': 'a', 'email': 'a@example.com'}])
+        self.assertEqual(HLContact.objects.get(hl_id='a').imported_at, imported_at)
+
+
+class DealPushTests(TestCase):
+    def setUp(self):
+        self.hl_pipeline = HLPipeline.objects.create(hl_id='hl-sales', name='Sales', hl_json={})
+        self.hl_won = HLDealstage.objects.create(hl_id='hl-won', name='Won', hl_pipeline=self.hl_pipeline, hl_json={})
+        self.pipeline = PipeLine.objects.create(ac_id='1', name='Sales', ac_json={})
+        self.closed = DealStage.objects.create(ac_id='1', name='Closed', pipeline=self.pipeline, hl_dealstage=self.hl_won)
+        self.contact = Contact.objects.create(ac_id='1', email='c@example.com', first_name='C', last_name='C', hl_id='hl-c')
+        self.client = mock.Mock()
+        patcher = mock.patch('sync.highlevel_sync.get_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_deal(self, ac_id, contact=None, stage=None, **fields):
+        fields = {'ac_json': {}, 'content_hash': f'hash-{ac_id}', **fields}
+        return Deal.objects.create(ac_id=ac_id, contact=contact or self.contact, stage=stage or self.closed, **fields)
+
+    def test_stage_names_dont_take_an_already_linked_highlevel_stage(self):
+        won = DealStage.objects.create(ac_id='2', name='won', pipeline=self.pipeline)
+        lead = DealStage.objects.create(ac_id='3', name='Lead', pipeline=self.pipeline)
+        self.client.get.return_value = mock.Mock(status_code=200, json=lambda: {'pipelines': [{
+            'id': 'hl-sales', 'name': 'Sales',
+            'stages': [{'id': 'hl-won', 'name': 'Won'}, {'id': 'hl-lead', 'name': 'Lead'}],
+        }]})
+
+        self.assertEqual(sync_highlevel_pipelines(), 1)
+
+        self.assertEqual(DealStage.objects.get(id=self.closed.id).hl_dealstage.hl_id, 'hl-won')
+        self.assertIsNone(DealStage.objects.get(id=won.id).hl_dealstage)
+        self.assertEqual(DealStage.objects.get(id=lead.id).hl_dealstage.hl_id, 'hl-lead')
+
+    def test_deals_to_push_need_a_highlevel_contact_and_a_mapped_stage(self):
+        unmapped = DealStage.objects.create(ac_id='2', name='Lead', pipeline=self.pipeline)
+        not_in_highlevel = Contact.objects.create(ac_id='2', email='d@example.com', first_name='D', last_name='D')
+        pushable = self.create_deal('1')
+        self.create_deal('2', contact=not_in_highlevel)
+        self.create_deal('3', stage=unmapped)
+        self.create_deal('4', hl_synced_hash='hash-4')
+
+        self.assertEqual(list(get_deals_to_push()), [pushable.id])
+
+    def test_opportunity_values_are_converted_from_cents(self):
+        deal = self.create_deal('1', title='Deal', value=Decimal('12345'), ac_json={'status': '1'})
+        self.assertEqual(build_opportunity_payload(deal), {
+            'title': 'Deal', 'status': 'won', 'stageId': 'hl-won', 'contactId': 'hl-c', 'monetaryValue': 123.45,
+        })
+
+    def test_pushed_deal_records_its_highlevel_id_and_hash(self):
+        deal = self.create_deal('1', title='Deal')
+        self.client.post.return_value = mock.Mock(status_code=201, json=lambda: {'opportunity': {'id': 'hl-opp'}})
+
+        result = sync_deal_to_highlevel(Deal.objects.select_related('contact', 'stage__hl_dealstage__hl_pipeline').get())
+
+        self.assertEqual((result.action, result.hl_id), ('created', 'hl-opp'))
+        self.client.post.assert_called_once_with('pipelines/hl-sales/opportunities/', json=build_opportunity_payload(deal))
+        deal.refresh_from_db()
+        self.assertEqual((deal.hl_id, deal.hl_synced_hash), ('hl-opp', 'hash-1'))
+
+
+@override_settings(SQLITE_SINGLE_WRITER=True, SQLITE_WRITER_QUEUE='writer')
+class SingleWriterTests(TestCase):
+    def test_writes_for_created_contacts_are_flushed_right_away(self):
+        contacts = [Contact.objects.create(ac_id=str(i), email=f'c{i}@example.com', first_name='C', last_name='C')
+                    for i in range(3)]
+
+        def push(contact, writes=None, **kwargs):
+            action = 'created' if contact.id == contacts[0].id else 'updated'
+            writes.update(contact, ['hl_id', 'hl_synced_hash'])
+            return SyncResult(contact.id, action)
+
+        with mock.patch.object(sync_script, 'sync_contact_to_highlevel', side_effect=push), \
+                mock.patch('sync.write_queue.apply_writes_task.apply_async') as apply_async:
+            sync_script.sync_contacts_to_highlevel_task([contact.id for contact in contacts])
+
+        batches = [call.kwargs['args'][0] for call in apply_async.call_args_list]
+        self.assertEqual([[operation['pk'] for operation in batch] for batch in batches],
+                         [[contacts[0].id], [contacts[1].id, contacts[2].id]])
+        self.assertEqual({call.kwargs['queue'] for call in apply_async.call_args_list}, {'writer'})
+
+    def test_full_push_flushes_created_contacts_right_away(self):
+        contacts = [Contact.objects.create(ac_id=str(i), email=f'c{i}@example.com', first_name='C', last_name='C')
+                    for i in range(3)]
+
+        def push(contact, writes=None, **kwargs):
+            writes.update(contact, ['hl_id', 'hl_synced_hash'])
+            return SyncResult(contact.id, 'created' if contact.id == contacts[0].id else 'updated')
+
+        with mock.patch('sync.highlevel_sync.sync_contact_to_highlevel', side_effect=push), \
+                mock.patch('sync.write_queue.apply_writes_task.apply_async') as apply_async:
+            sync_all_contacts_to_highlevel()
+
+        batches = [call.kwargs['args'][0] for call in apply_async.call_args_list]
+        self.assertEqual([operation['pk'] for operation in batches[0]], [contacts[0].id])
+        self.assertEqual([operation['pk'] for operation in batches[1]][:2], [contacts[1].id, contacts[2].id])
+
+    def test_directory_deletes_and_push_counts_go_to_the_writer(self):
+        HLContact.objects.create(hl_id='hl-gone', email='c@example.com')
+        contact = Contact.objects.create(ac_id='1', email='c@example.com', first_name='C', last_name='C', hl_id='hl-gone')
+        sync_log = SyncLog.objects.create(sync_type='push')
+        client = mock.Mock()
+        client.put.return_value = mock.Mock(status_code=404, text='Not found')
+        writes = WriteBuffer()
+
+        with mock.patch('sync.highlevel_sync.get_client', return_value=client), \
+                mock.patch('sync.write_queue.apply_writes_task.apply_async') as apply_async, \
+                self.assertLogs('sync.highlevel_sync', 'WARNING'):
+            self.assertFalse(sync_contact_to_highlevel(contact, payload={}, writes=writes).success)
+            writes.flush()
+            sync_script.add_push_counts(sync_log.id, [{'synced': 2, 'failed': 1}], 'contacts_synced', 'contacts_failed')
+
+        self.assertTrue(HLContact.objects.exists())
+        batches = [call.kwargs['args'][0] for call in apply_async.call_args_list]
+        self.assertEqual([operation['op'] for batch in batches for operation in batch],
+                         ['delete_highlevel_contact', 'increment'])
+        for batch in batches:
+            apply_writes(batch)
+        self.assertFalse(HLContact.objects.exists())
+        sync_log.refresh_from_db()
+        self.assertEqual((sync_log.contacts_synced, sync_log.contacts_failed), (2, 1))
+
+    def test_deal_push_is_ordered_on_the_writer_queue_but_runs_on_the_default_one(self):
+        sync_log = SyncLog.objects.create(sync_type='push')
+        with mock.patch.object(sync_script.start_deal_push_task, 'apply_async') as start, \
+                mock.patch.object(sync_script.push_deals_to_highlevel_task, 'delay') as push, \
+                mock.patch('sync.write_queue.apply_writes_task.apply_async'):
+            sync_script.finalize_highlevel_sync_task([{'synced': 1, 'failed': 0}], sync_log.id)
+            start.assert_called_once_with(args=[sync_log.id], queue='writer')
+            push.assert_not_called()
+
+            sync_script.start_deal_push_task(sync_log.id)
+            push.assert_called_once_with(sync_log.id)
+
+
+@mock.patch.multiple(sync_script, HIGHLEVEL_PUSH_CHUNK_SIZE=2, HIGHLEVEL_PUSH_WINDOW_CHUNKS=2)
+class PushWindowTests(TestCase):
+    def setUp(self):
+        self.sync_log = SyncLog.objects.create(sync_type='push')
+        self.contact_ids = []
+        for i in range(5):
+            contact = Contact.objects.create(ac_id=str(i), email=f'c{i}@example.com', first_name='C', last_name='C')
+            HighLevelOutbox.objects.create(contact=contact)
+            self.contact_ids.append(contact.id)
+
+    def test_outbox_is_pushed_a_window_at_a_time(self):
+        drained_at = timezone.now().isoformat()
+        with mock.patch.object(sync_script, 'chord') as chord, \
+                mock.patch.object(sync_script.finalize_highlevel_sync_task, 'delay') as finalize:
+            self.assertEqual(sync_script.schedule_highlevel_sync(self.sync_log.id, drained_at), 4)
+            chunks = [task.args[0] for task in chord.call_args.args[0].tasks]
+            self.assertEqual(chunks, [self.contact_ids[:2], self.contact_ids[2:4]])
+            callback = chord.return_value.call_args.args[0]
+            self.assertEqual(callback.args, (self.sync_log.id, drained_at, self.contact_ids[3]))
+
+            results = [{'synced': 2, 'skipped': 0, 'failed': 0}, {'synced': 1, 'skipped': 0, 'failed': 1}]
+            sync_script.continue_highlevel_sync_task(results, *callback.args)
+            self.assertEqual([task.args[0] for task in chord.call_args.args[0].tasks], [self.contact_ids[4:]])
+
+            callback = chord.return_value.call_args.args[0]
+            sync_script.continue_highlevel_sync_task([{'synced': 1, 'skipped': 0, 'failed': 0}], *callback.args)
+            finalize.assert_called_once_with([], self.sync_log.id)
+
+        self.sync_log.refresh_from_db()
+        self.assertEqual((self.sync_log.contacts_synced, self.sync_log.contacts_failed), (4, 1))
+
+    def test_contacts_changed_during_a_push_stay_pending(self):
+        drained_at = timezone.now()
+        changed = self.contact_ids[1]
+        with mock.patch('sync.highlevel_sync.timezone.now', return_value=drained_at + timedelta(seconds=1)):
+            mark_contacts_dirty([changed])
+
+        with mock.patch.object(sync_script, 'sync_contact_to_highlevel',
+                               side_effect=lambda contact, **kwargs: SyncResult(contact.id, 'updated')):
+            sync_script.sync_contacts_to_highlevel_task(self.contact_ids[:2], drained_at.isoformat())
+
+        pending = HighLevelOutbox.objects.filter(processed_at__isnull=True)
+        self.assertEqual(sorted(pending.values_list('contact_id', flat=True)), [changed, *self.contact_ids[2:]])
+        self.assertEqual(list(sync_script.get_pending_outbox(drained_at.isoformat()).values_list('contact_id', flat=True)
+                              .order_by('contact_id')), self.contact_ids[2:])
+
+        # A pushed contact that changes again is pending again
+        mark_contacts_dirty([self.contact_ids[0]])
+        self.assertTrue(pending.filter(contact_id=self.contact_ids[0]).exists())
+
+    def test_failing_chunk_still_returns_counts(self):
+        with mock.patch.object(sync_script, 'build_highlevel_payloads', side_effect=RuntimeError('boom')), \
+                self.assertLogs(sync_script.logger, 'ERROR'):
+            counts = sync_script.sync_contacts_to_highlevel_task(self.contact_ids[:2])
+        self.assertEqual(counts, {'synced': 0, 'skipped': 0, 'failed': 2})
+
+
+class ContactRawPayloadTests(TestCase):
+    def setUp(self):
+        self.contact = Contact.objects.create(ac_id='1', email='c@example.com', first_name='C', last_name='C')
+        self.payload = {'id': '1', 'email': 'c@example.com', 'custom_fields': [{'field': '1'}], 'deals': [{'id': '2'}]}
+
+    def test_keeps_only_the_contacts_own_fields(self):
+        ContactRawPayload.from_contact(self.contact.id, self.payload).save()
+        self.assertEqual(self.contact.raw_payload.load(), {'email': 'c@example.com', 'id': '1'})
+
+    @override_settings(SYNC_PAYLOAD_COMPRESSION='none')
+    def test_uncompressed_payloads_are_compact_json(self):
+        raw = ContactRawPayload.from_contact(self.contact.id, self.payload)
+        self.assertFalse(raw.compressed)
+        self.assertEqual(bytes(raw.data), b'{"email":"c@example.com","id":"1"}')
+
+
+class DeltaContactHashTests(TestCase):
+    """A delta page only carries a contact's changed deals, so deals must not affect the contact's hash"""
+
+    def setUp(self):
+        self.deal = {
+            'id': '10', 'title': 'Deal', 'stage': '1', 'pipeline': '1', 'value': '100',
+            'cdate': '2024-01-01T00:00:00-05:00', 'mdate': '2024-01-02T00:00:00-05:00',
+        }
+        self.contact = {'id': '1', 'email': 'c@example.com', 'firstName': 'C', 'lastName': 'C',
+                        'custom_fields': [], 'deals': [self.deal]}
+        sync_script.bulk_upsert_contacts([self.contact])
+
+    def test_changed_contact_without_its_deals_hashes_like_a_full_sync(self):
+        changed = {**self.contact, 'firstName': 'Changed'}
+        self.assertEqual(sync_script.bulk_upsert_contacts([{**changed, 'deals': []}]), 1)
+        self.assertEqual(Contact.objects.get().content_hash, sync_script.contact_content_hash(changed))
+        self.assertEqual(Deal.objects.get().title, 'Deal')
+
+    def test_changed_deal_of_an_unchanged_contact_is_written(self):
+        contact = {**self.contact, 'deals': [{**self.deal, 'title': 'Renamed'}]}
+        self.assertEqual(sync_script.bulk_upsert_contacts([contact]), 0)
+        self.assertEqual(Deal.objects.get().title, 'Renamed')
+
+    def test_per_contact_writer_also_writes_changed_deals(self):
+        sync_script.process_contact({**self.contact, 'deals': [{**self.deal, 'title': 'Renamed'}]})
+        self.assertEqual(Deal.objects.get().title, 'Renamed')
+
+
+class BulkUpsertContactsTests(TestCase):
+    def make_contact(self, ac_id, first_name='C', fields=('1', '2'), deal_title='Deal', stage='1'):
+        return {
+            'id': ac_id, 'email': f'c{ac_id}@example.com', 'firstName': first_name, 'lastName': 'C',
+            'custom_fields': [{'field': field, 'value': f'{ac_id}-{field}', 'fieldTitle': f'Field {field}'} for field in fields],
+            'deals': [{
+                'id': ac_id, 'title': deal_title, 'stage': stage, 'pipeline': '1', 'value': '100',
+                'stage_title': f'Stage {stage}', 'pipeline_title': 'Sales',
+                'cdate': '2024-01-01T00:00:00-05:00', 'mdate': '2024-01-02T00:00:00-05:00',
+            }],
+        }
+
+    def make_pages(self):
+        return [
+            [self.make_contact('1'), self.make_contact('2'), self.make_contact('3')],
+            [
+                self.make_contact('1', first_name='Changed'),
+                self.make_contact('2', deal_title='Renamed'),
+                self.make_contact('4', fields=('1', '3'), stage='2'),
+            ],
+        ]
+
+    def stored_rows(self):
+        return {
+            'contacts': sorted(Contact.objects.values_list('ac_id', 'email', 'first_name', 'last_name', 'content_hash')),
+            'payloads': {raw.contact.ac_id: raw.load() for raw in ContactRawPayload.objects.select_related('contact')},
+            'outbox': sorted(HighLevelOutbox.objects.values_list('contact__ac_id', flat=True)),
+            'custom_fields': sorted(CustomField.objects.values_list('ac_id', 'type', 'ac_title')),
+            'field_values': sorted(ContactCustomField.objects.values_list('contact__ac_id', 'custom_field__ac_id', 'value')),
+            'stages': sorted(DealStage.objects.values_list('ac_id', 'name', 'pipeline__ac_id', 'pipeline__name')),
+            'deals': sorted(Deal.objects.values_list(
+                'ac_id', 'contact__ac_id', 'stage__ac_id', 'title', 'value', 'currency', 'created_date', 'updated_date',
+                'content_hash'
+            )),
+        }
+
+    def test_bulk_writer_stores_the_same_rows_as_the_per_contact_writer(self):
+        reference_ids = ReferenceIds()
+        for page in self.make_pages():
+            for contact in page:
+                sync_script.process_contact(contact, reference_ids)
+        per_contact = self.stored_rows()
+
+        for model in (Deal, ContactCustomField, ContactRawPayload, HighLevelOutbox, Contact, DealStage, PipeLine, CustomField):
+            model.objects.all().delete()
+        reference_ids = ReferenceIds()
+        for page in self.make_pages():
+            sync_script.bulk_upsert_contacts(page, reference_ids)
+
+        self.assertEqual(self.stored_rows(), per_contact)
+        self.assertEqual(len(per_contact['deals']), 4)
+
+    def test_page_is_written_in_a_fixed_number_of_queries(self):
+        fields = {ac_id: CustomField.objects.create(ac_id=ac_id, type='text', ac_title=ac_id).id for ac_id in ('1', '2')}
+        pipeline = PipeLine.objects.create(ac_id='1', name='Sales', ac_json={})
+        stage = DealStage.objects.create(ac_id='1', name='Stage 1', pipeline=pipeline, ac_json={})
+        reference_ids = ReferenceIds({'custom_fields': fields, 'pipelines': {'1': pipeline.id}, 'stages': {'1': stage.id}})
+        page = [self.make_contact(str(i)) for i in range(100)]
+        for contact in page[50:]:
+            # Keeps every insert within one batch on SQLite
+            contact['deals'] = []
+
+        # Stored contact and deal hashes, then contacts, their ids, payloads, outbox, field values and deals
+        with self.assertNumQueries(8):
+            self.assertEqual(sync_script.bulk_upsert_contacts(page, reference_ids), 100)
+
+
+class ReferenceIdsTests(TestCase):
+    def setUp(self):
+        self.known = CustomField.objects.create(ac_id='1', type='text', ac_title='Known')
+        self.reference_ids = ReferenceIds.load()
+
+    def resolve(self, items):
+        return self.reference_ids.resolve('custom_fields', items, sync_script.build_custom_field)
+
+    def test_known_ids_are_resolved_from_memory(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve({'1': {}}), {'1': self.known.id})
+
+    def test_created_ids_are_remembered_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = self.resolve({'1': {}, '2': {'fieldTitle': 'New'}})
+            self.assertNotIn('2', self.reference_ids['custom_fields'])
+        self.assertEqual(CustomField.objects.get(id=ids['2']).ac_title, 'New')
+        self.assertEqual(self.reference_ids['custom_fields'], {'1': self.known.id, '2': ids['2']})
+
+    def test_rolled_back_ids_are_not_remembered(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.resolve({'2': {}})
+                raise RuntimeError
+        self.assertEqual(self.reference_ids['custom_fields'], {'1': self.known.id})
+        self.assertFalse(CustomField.objects.filter(ac_id='2').exists())
+
+    def test_reload_drops_deleted_rows(self):
+        self.known.delete()
+        added = CustomField.objects.create(ac_id='2', type='text', ac_title='Added')
+        self.reference_ids.reload()
+        self.assertEqual(self.reference_ids['custom_fields'], {'2': added.id})
+
+
+class SyncPipelinesAndStagesTests(TestCase):
+    def test_pipelines_and_stages_are_mirrored_in_bulk(self):
+        sales = PipeLine.objects.create(ac_id='1', name='Old name', ac_json={})
+        hl_pipeline = HLPipeline.objects.create(hl_id='hl-sales', name='Sales', hl_json={})
+        hl_won = HLDealstage.objects.create(hl_id='hl-won', name='Won', hl_pipeline=hl_pipeline, hl_json={})
+        won = DealStage.objects.create(ac_id='1', name='Old name', pipeline=sales, hl_dealstage=hl_won)
+        pipelines = [{'id': '1', 'title': 'Sales'}, {'id': '2', 'title': 'Support'}]
+        stages = [
+            {'id': '1', 'title': 'Won', 'order': 2, 'group': '1'},
+            {'id': '2', 'title': 'Lead', 'order': 1, 'group': '1'},
+            {'id': '3', 'title': 'Open', 'order': 1, 'group': '2'},
+        ]
+
+        with mock.patch.multiple(
+            sync_script,
+            get_activecampaign_pipelines=mock.Mock(return_value=pipelines),
+            get_activecampaign_deal_stages=mock.Mock(return_value=stages),
+        ), self.captureOnCommitCallbacks(execute=True):
+            reference_ids = sync_script.sync_pipelines_and_stages('http://ac.invalid/api/3', {}, ReferenceIds())
+
+        self.assertEqual(PipeLine.objects.get(id=sales.id).name, 'Sales')
+        self.assertEqual(
+            sorted(DealStage.objects.values_list('ac_id', 'name', 'order', 'pipeline__ac_id')),
+            [('1', 'Won', 2, '1'), ('2', 'Lead', 1, '1'), ('3', 'Open', 1, '2')],
+        )
+        # The HighLevel link isn't something AC knows about, so it is kept
+        self.assertEqual(DealStage.objects.get(id=won.id).hl_dealstage_id, hl_won.id)
+        self.assertEqual(reference_ids['pipelines'], dict(PipeLine.objects.values_list('ac_id', 'id')))
+        self.assertEqual(reference_ids['stages'], dict(DealStage.objects.values_list('ac_id', 'id')))
+
+
+class ExplainSyncQueriesTests(TestCase):
+    def test_deal_window_is_reported_as_a_scan(self):
+        out = StringIO()
+        call_command('explain_sync_queries', stdout=out, no_color=True)
+        deal_window = out.getvalue().split('Window of deals to push')[1]
+        self.assertIn('Full table scan', deal_window)
+        self.assertNotIn('All sync queries use indexes', out.getvalue())
+
+
+@skipUnless(connection.vendor == 'postgresql', "COPY bulk loading needs PostgreSQL")
+@override_settings(SYNC_BULK_LOAD='copy')
+class CopyBulkLoadTests(TestCase):
+    def test_copy_upsert_inserts_and_updates(self):
+        CustomField.objects.create(ac_id='1', type='text', ac_title='Old', ac_json={'id': '1'})
+        self.assertTrue(use_copy_load())
+
+        with transaction.atomic():
+            bulk_upsert(
+                CustomField,
+                [
+                    CustomField(ac_id='1', type='textarea', ac_title='New', ac_json={'id': '1', 'x': 'a\tb'}),
+                    CustomField(ac_id='2', type='text', ac_title='Two', ac_json=None),
+                ],
+                unique_fields=['ac_id'],
+                update_fields=['type', 'ac_title', 'ac_json'],
+            )
+
+        self.assertEqual(
+            sorted(CustomField.objects.values_list('ac_id', 'type', 'ac_title', 'ac_json')),
+            [('1', 'textarea', 'New', {'id': '1', 'x': 'a\tb'}), ('2', 'text', 'Two', None)],
+        )
+
+    def test_copy_upsert_raw_payloads(self):
+        contact = Contact.objects.create(ac_id='1', email='c@example.com', first_name='C', last_name='C')
+        ContactRawPayload.from_contact(contact.id, {'id': '1', 'email': 'old'}).save()
+
+        with transaction.atomic():
+            bulk_upsert(
+                ContactRawPayload,
+                [ContactRawPayload.from_contact(contact.id, {'id': '1', 'email': 'new\\x00'})],
+                unique_fields=['contact'],
+                update_fields=['data', 'compressed'],
+            )
+
+        self.assertEqual(ContactRawPayload.objects.get().load(), {'id': '1', 'email': 'new\\x00'})
+
+    def test_copy_upsert_on_contact_custom_field_pairs(self):
+        contact = Contact.objects.create(ac_id='1', email='c@example.com', first_name='C', last_name='C')
+        fields = [CustomField.objects.create(ac_id=str(i), type='text', ac_title=f'Field {i}') for i in range(2)]
+        ContactCustomField.objects.create(contact=contact, custom_field=fields[0], value='old')
+
+        with transaction.atomic():
+            bulk_upsert(
+                ContactCustomField,
+                [ContactCustomField(contact=contact, custom_field=field, value=f'new {field.ac_id}') for field in fields],
+                unique_fields=['contact', 'custom_field'],
+                update_fields=['value'],
+            )
+
+        self.assertEqual(
+            sorted(ContactCustomField.objects.values_list('custom_field__ac_id', 'value')),
+            [('0', 'new 0'), ('1', 'new 1')],
+        )
+
+
+class StandInActiveCampaign:
+    """
+    Local HTTP server answering /contacts and /deals like ActiveCampaign, with injected latency.
+    `latency(params)` gives the seconds to wait before answering; the most requests seen in
+    flight at once is kept in `max_in_flight`.
+    """
+
+    def __init__(self, total, latency):
+        self.total = total
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                with stand_in.lock:
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight, stand_in.in_flight)
+                try:
+                    time.sleep(stand_in.latency(params))
+                    body = json.dumps(stand_in.respond(url.path.rsplit('/', 1)[-1], params)).encode()
+                finally:
+                    with stand_in.lock:
+                        stand_in.in_flight -= 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/api/3"
+
+    def respond(self, endpoint, params):
+        offset, limit = int(params.get('offset', 0)), int(params.get('limit', 20))
+        ids = range(offset + 1, min(offset + limit, self.total) + 1)
+        if endpoint == 'contacts':
+            return {'contacts': [{'id': str(i)} for i in ids], 'fieldValues': [], 'meta': {'total': str(self.total)}}
+        return {endpoint: [{'id': str(i), 'contact': str(i)} for i in ids], 'meta': {'total': str(self.total)}}
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ConcurrentFetchTests(SimpleTestCase):
+    def setUp(self):
+        # A limiter that never gets in the way, so only the injected latency counts
+        patcher = mock.patch.object(sync_script, 'session', sync_script.RateLimitedSession(SharedRateLimiter('test', 1000)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_contact_pages_are_fetched_concurrently(self):
+        pages = []
+        with StandInActiveCampaign(total=800, latency=lambda params: 0.2) as stand_in:
+            started = time.monotonic()
+            sync_script.process_activecampaign_contact_pages(
+                stand_in.base_url, {},
+                ({'limit': 100, 'offset': offset} for offset in range(0, 800, 100)),
+                persist_page=pages.append, concurrency=4, deals_index={},
+            )
+            elapsed = time.monotonic() - started
+
+        self.assertGreater(stand_in.max_in_flight, 1)
+        self.assertLess(elapsed, 8 * 0.2)
+        self.assertEqual(sorted(int(contact['id']) for page in pages for contact in page), list(range(1, 801)))
+
+    def test_collection_pages_keep_their_order(self):
+        # Later pages answer first
+        with StandInActiveCampaign(total=500, latency=lambda params: 0.3 - int(params['offset']) / 2000) as stand_in:
+            deals = sync_script.get_activecampaign_collection(stand_in.base_url, {}, 'deals', 'deals', concurrency=4)
+
+        self.assertGreater(stand_in.max_in_flight, 1)
+        self.assertEqual([deal['id'] for deal in deals], [str(i) for i in range(1, 501)])
+
+
+class StubActiveCampaignSession:
+    """
+    Stands in for the AC session: answers /contacts (keyset, by ids, or the total) with the
+    page's sideloaded fieldValues, and /deals, from memory and records each request's endpoint
+    and params.
+    """
+
+    def __init__(self, contact_ids, deals=(), fail=None, field_values=()):
+        self.contact_ids = sorted(contact_ids)
+        self.deals = list(deals)
+        self.field_values = list(field_values)
+        # fail(endpoint, params) -> True answers that request with a server error
+        self.fail = fail
+        self.requests = []
+
+    def request(self, method, url, params=None, **kwargs):
+        params = dict(params or {})
+        endpoint = url.rsplit('/', 1)[-1]
+        self.requests.append((endpoint, params))
+        response = mock.Mock()
+        if self.fail and self.fail(endpoint, params):
+            response.raise_for_status.side_effect = requests.exceptions.HTTPError('500 Server Error')
+            return response
+
+        limit = int(params.get('limit', 20))
+        if endpoint == 'deals':
+            offset = int(params.get('offset', 0))
+            data = {'deals': self.deals[offset:offset + limit], 'meta': {'total': str(len(self.deals))}}
+        else:
+            if 'ids' in params:
+                ids = [int(contact_id) for contact_id in params['ids'].split(',')]
+            elif 'offset' in params:
+                ids = self.contact_ids[int(params['offset']):]
+            else:
+                ids = [contact_id for contact_id in self.contact_ids if contact_id > int(params.get('id_greater', 0))]
+            page_ids = {str(contact_id) for contact_id in ids[:limit]}
+            data = {
+                'contacts': [{'id': str(contact_id)} for contact_id in ids[:limit]],
+                'fieldValues': [value for value in self.field_values if value['contact'] in page_ids],
+                'meta': {'total': str(len(self.contact_ids))},
+            }
+        response.json.return_value = data
+        return response
+
+
+class KeysetWalkTests(SimpleTestCase):
+    def test_walk_follows_the_last_id_and_stops_on_a_short_page(self):
+        stub = StubActiveCampaignSession(range(2, 502, 2))
+        persisted = []
+
+        with mock.patch.object(sync_script, 'session', stub):
+            sync_script.process_activecampaign_contact_pages(
+                'http://ac.invalid/api/3', {}, sync_script.KeysetPageParams(page_limit=100), persisted.extend, deals_index={}
+            )
+
+        self.assertEqual([params['id_greater'] for endpoint, params in stub.requests], [0, 200, 400])
+        self.assertEqual([contact['id'] for contact in persisted], [str(i) for i in range(2, 502, 2)])
+
+    def test_walk_resumes_after_the_checkpoint(self):
+        stub = StubActiveCampaignSession(range(1, 11))
+        page_params = sync_script.KeysetPageParams(page_limit=3, start_after_id=4)
+
+        with mock.patch.object(sync_script, 'session', stub):
+            sync_script.process_activecampaign_contact_pages('http://ac.invalid/api/3', {}, page_params, list, deals_index={})
+
+        # 5-7, 8-10, then an empty page as the last full page could have been the end
+        self.assertEqual([params['id_greater'] for endpoint, params in stub.requests], [4, 7, 10])
+
+
+class DealsIndexTests(SimpleTestCase):
+    def test_contacts_get_their_deals_from_one_scan(self):
+        deals = [{'id': str(i), 'contact': str(i % 3 + 1)} for i in range(150)]
+        stub = StubActiveCampaignSession(range(1, 5), deals=deals)
+        persisted = []
+
+        with mock.patch.object(sync_script, 'session', stub):
+            deals_index = sync_script.get_activecampaign_deals_index('http://ac.invalid/api/3', {})
+            sync_script.process_activecampaign_contact_pages(
+                'http://ac.invalid/api/3', {}, sync_script.KeysetPageParams(page_limit=10), persisted.extend,
+                deals_index=deals_index,
+            )
+
+        self.assertEqual([endpoint for endpoint, params in stub.requests], ['deals', 'deals', 'contacts'])
+        deals_by_contact = {contact['id']: [deal['id'] for deal in contact['deals']] for contact in persisted}
+        self.assertEqual(deals_by_contact['1'], [str(i) for i in range(0, 150, 3)])
+        self.assertEqual(len(deals_by_contact['3']), 50)
+        self.assertEqual(deals_by_contact['4'], [])
+
+
+class SideloadedFieldValuesTests(SimpleTestCase):
+    def test_contacts_get_only_their_own_field_values(self):
+        # Sideloaded in no particular order, as AC returns them
+        field_values = [
+            {'id': '1', 'contact': '2', 'field': '1', 'value': 'two'},
+            {'id': '2', 'contact': '1', 'field': '1', 'value': 'one'},
+            {'id': '3', 'contact': '2', 'field': '2', 'value': 'two again'},
+        ]
+        stub = StubActiveCampaignSession(range(1, 4), field_values=field_values)
+        persisted = []
+
+        with mock.patch.object(sync_script, 'session', stub):
+            sync_script.process_activecampaign_contact_pages(
+                'http://ac.invalid/api/3', {}, sync_script.KeysetPageParams(page_limit=10), persisted.extend, deals_index={}
+            )
+
+        self.assertEqual(stub.requests[0][1]['include'], 'fieldValues')
+        self.assertEqual(len(stub.requests), 1)
+        values = {contact['id']: [field['value'] for field in contact['custom_fields']] for contact in persisted}
+        self.assertEqual(values, {'1': ['one'], '2': ['two', 'two again'], '3': []})
+
+
+class ContactIngestTests(TestCase):
+    def ingest(self, stub, sync_log, **kwargs):
+        with mock.patch.multiple(
+            sync_script,
+            session=stub,
+            get_activecampaign_base_url=mock.Mock(return_value='http://ac.invalid/api/3'),
+            process_contacts=mock.Mock(side_effect=lambda contacts, reference_ids: (len(contacts), 0)),
+        ):
+            return sync_script.get_and_process_activecampaign_contacts(sync_log=sync_log, reference_ids=mock.Mock(), **kwargs)
+
+    def test_delta_contacts_picked_up_by_id_dont_move_the_checkpoint(self):
+        deals = [{'id': '1', 'contact': '100'}, {'id': '2', 'contact': '30'}, {'id': '3', 'contact': '5'}]
+        stub = StubActiveCampaignSession([5, 10], deals)
+        sync_log = SyncLog.objects.create(sync_type='delta')
+
+        with self.assertLogs('sync.scripts.sync', 'INFO') as logs:
+            self.ingest(stub, sync_log, updated_since=timezone.now(), pagination='keyset')
+
+        sync_log.refresh_from_db()
+        self.assertEqual(sync_log.checkpoint_last_id, 10)
+        self.assertEqual(sync_log.contacts_attempted, 4)
+        # In numeric order, not '100,30'
+        self.assertEqual([params['ids'] for endpoint, params in stub.requests if 'ids' in params], ['30,100'])
+        # The throughput report covers both passes
+        self.assertTrue(any('persist: 2 pages, 4 contacts' in line for line in logs.output))
+
+    def test_offset_pages_that_fail_count_as_not_stored(self):
+        stub = StubActiveCampaignSession(range(1, 251), fail=lambda endpoint, params: params.get('offset') == 100)
+        sync_log = SyncLog.objects.create()
+
+        with self.assertLogs('sync.scripts.sync', 'ERROR'):
+            self.assertEqual(self.ingest(stub, sync_log, pagination='offset', concurrency=2), (150, 0))
+
+        sync_log.refresh_from_db()
+        self.assertEqual((sync_log.contacts_attempted, sync_log.contacts_ingest_failed), (150, 100))
+
+    def test_delta_pages_by_id_that_fail_count_as_not_stored(self):
+        deals = [{'id': '1', 'contact': '30'}, {'id': '2', 'contact': '40'}]
+        stub = StubActiveCampaignSession([5], deals, fail=lambda endpoint, params: 'ids' in params)
+        sync_log = SyncLog.objects.create(sync_type='delta')
+
+        with self.assertLogs('sync.scripts.sync', 'ERROR'):
+            self.ingest(stub, sync_log, updated_since=timezone.now(), pagination='keyset')
+
+        sync_log.refresh_from_db()
+        self.assertEqual((sync_log.contacts_attempted, sync_log.contacts_ingest_failed), (1, 2))
+
+
+class RunPipelineTests(SimpleTestCase):
+    def fetch_page(self, params):
+        return {'contacts': [{'id': params}]}
+
+    def enrich_page(self, page):
+        return page['contacts']
+
+    def assert_pipeline_threads_stopped(self):
+        self.assertEqual([thread for thread in threading.enumerate() if thread.name.startswith('pipeline-')], [])
+
+    def test_single_workers_keep_page_order(self):
+        persisted = []
+        stats = run_pipeline(range(50), self.fetch_page, self.enrich_page, persisted.extend)
+
+        self.assertEqual([contact['id'] for contact in persisted], list(range(50)))
+        self.assertEqual([(stage.name, stage.pages, stage.contacts) for stage in stats],
+                         [('fetch', 50, 50), ('enrich', 50, 50), ('persist', 50, 50)])
+
+    def test_errors_in_any_stage_are_raised(self):
+        def fail(*args):
+            raise ValueError('stage failed')
+
+        for stage in ('fetch_page', 'enrich_page', 'persist_page'):
+            with self.subTest(stage=stage):
+                stages = {'fetch_page': self.fetch_page, 'enrich_page': self.enrich_page, 'persist_page': list, stage: fail}
+                with self.assertRaisesMessage(ValueError, 'stage failed'):
+                    run_pipeline(range(10), fetch_workers=2, enrich_workers=2, **stages)
+                self.assert_pipeline_threads_stopped()
+
+    def test_persist_failure_stops_the_other_stages(self):
+        fetched = itertools.count()
+
+        def fetch_page(params):
+            next(fetched)
+            return self.fetch_page(params)
+
+        def persist_page(contacts):
+            raise RuntimeError('database down')
+
+        with self.assertRaisesMessage(RuntimeError, 'database down'):
+            run_pipeline(itertools.count(), fetch_page, self.enrich_page, persist_page, fetch_workers=3, enrich_workers=2)
+        self.assert_pipeline_threads_stopped()
+        self.assertLess(next(fetched), 100)
+
+    def test_fetch_runs_at_most_a_few_queues_ahead_of_a_stalled_persist(self):
+        queue_size = 2
+        fetched = itertools.count()
+        release = threading.Event()
+        fetched_while_stalled = []
+
+        def fetch_page(params):
+            next(fetched)
+            return self.fetch_page(params)
+
+        def persist_page(contacts):
+            release.wait(5)
+            raise RuntimeError('stop')
+
+        def stall():
+            time.sleep(0.3)
+            fetched_while_stalled.append(next(fetched))
+            release.set()
+
+        threading.Thread(target=stall).start()
+        with self.assertRaisesMessage(RuntimeError, 'stop'):
+            run_pipeline(itertools.count(), fetch_page, self.enrich_page, persist_page, queue_size=queue_size)
+
+        # One page each in persist, enrich and fetch, plus two full queues
+        self.assertGreater(fetched_while_stalled[0], queue_size)
+        self.assertLessEqual(fetched_while_stalled[0], 2 * queue_size + 3)
+
+
+class RunWatermarkTests(TestCase):
+    def run_sync(self, ingest_failed):
+        def ingest(sync_log=None, **kwargs):
+            sync_log.contacts_ingest_failed += ingest_failed
+            return 10, 10
+
+        with mock.patch.multiple(
+            sync_script,
+            check_api_connection=mock.Mock(return_value=True),
+            get_activecampaign_base_url=mock.Mock(return_value='http://ac.invalid/api/3'),
+            sync_pipelines_and_stages=mock.Mock(),
+            sync_custom_field_definitions=mock.Mock(),
+            get_and_process_activecampaign_contacts=mock.Mock(side_effect=ingest),
+            sync_highlevel_custom_fields=mock.Mock(),
+            import_highlevel_contacts_if_stale=mock.Mock(),
+            drain_highlevel_outbox_task=mock.Mock(),
+        ):
+            sync_script.run(full=True)
+        return SyncLog.objects.latest('id')
+
+    def test_watermark_advances_when_every_contact_was_stored(self):
+        sync_log = self.run_sync(ingest_failed=0)
+        self.assertEqual(sync_log.watermark, sync_log.start_time)
+        # run() leaves the module's log level alone, so its progress reports reach the handlers
+        self.assertEqual(sync_script.logger.level, logging.NOTSET)
+
+    def test_watermark_is_held_back_when_contacts_failed(self):
+        sync_log = self.run_sync(ingest_failed=2)
+        self.assertEqual(sync_log.status, 'Sync Tasks Scheduled')
+        self.assertEqual(sync_log.contacts_ingest_failed, 2)
+        self.assertIsNone(sync_log.watermark)
+
+
+def make_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+@mock.patch('time.sleep')
+class HighLevelClientRetryTests(SimpleTestCase):
+    def setUp(self):
+        self.client = HighLevelClient(api_key='key', base_url='http://hl.invalid')
+        self.client.limiter = mock.Mock()
+        self.session = self.client.session = mock.Mock()
+
+    def test_post_is_not_resent_after_a_server_error(self, sleep):
+        self.session.request.return_value = make_response(502)
+        self.assertEqual(self.client.post('contacts/').status_code, 502)
+        self.assertEqual(self.session.request.call_count, 1)
+
+    def test_post_is_not_resent_after_a_read_timeout(self, sleep):
+        self.session.request.side_effect = requests.exceptions.ReadTimeout()
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            self.client.post('contacts/')
+        self.assertEqual(self.session.request.call_count, 1)
+
+    def test_post_is_resent_after_429_with_a_capped_wait(self, sleep):
+        self.session.request.side_effect = [make_response(429, {'Retry-After': '3600'}), make_response(200)]
+        self.assertEqual(self.client.post('contacts/').status_code, 200)
+        self.assertEqual(self.session.request.call_count, 2)
+        sleep.assert_called_once_with(HL_MAX_RETRY_WAIT)
+
+    def test_post_is_resent_when_the_connection_was_never_made(self, sleep):
+        refused = requests.exceptions.ConnectionError(MaxRetryError(None, '/', NewConnectionError(None, 'refused')))
+        self.session.request.side_effect = [refused, requests.exceptions.ConnectTimeout(), make_response(201)]
+        self.assertEqual(self.client.post('contacts/').status_code, 201)
+        self.assertEqual(self.session.request.call_count, 3)
+
+    def test_idempotent_requests_are_resent_after_timeouts_and_server_errors(self, sleep):
+        self.session.request.side_effect = [requests.exceptions.ReadTimeout(), make_response(503), make_response(200)]
+        self.assertEqual(self.client.put('contacts/1').status_code, 200)
+        self.assertEqual(self.session.request.call_count, 3)
+
+
+class FakeClock:
+    """Replaces the time module in sync.rate_limit; sleeping advances the clock"""
+
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('sync.rate_limit.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_allows_bursts_then_refills_at_its_rate(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        self.assertEqual([bucket.take(), bucket.take()], [0, 0])
+        self.assertEqual(bucket.take(), 0.5)
+
+        self.clock.sleep(0.5)
+        self.assertEqual(bucket.take(), 0)
+        self.clock.sleep(10)
+        self.assertEqual([bucket.take(), bucket.take()], [0, 0])
+        self.assertGreater(bucket.take(), 0)
+
+    def test_acquire_waits_for_a_token(self):
+        bucket = TokenBucket(rate=4, capacity=1)
+        started = self.clock.now
+        for _ in range(5):
+            bucket.acquire()
+        self.assertAlmostEqual(self.clock.now - started, 1.0)
+
+    def test_throttling_halves_the_rate_and_blocks(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        bucket.adjust(throttled=True, block_for=3, ceiling=None, max_rate=2)
+        self.assertEqual(bucket.rate, 1)
+        self.assertEqual(bucket.take(), 3)
+
+    def test_falls_back_to_the_local_bucket_while_redis_is_down(self):
+        client = mock.Mock()
+        take_script = mock.Mock(side_effect=redis.ConnectionError('down'))
+        client.register_script.side_effect = [take_script, mock.Mock()]
+        limiter = SharedRateLimiter('test', 1, redis_client=client)
+
+        with self.assertLogs('sync.rate_limit', 'WARNING'):
+            self.assertEqual(limiter.take(), 0)
+        self.assertGreater(limiter.take(), 0)
+        self.assertEqual(take_script.call_count, 1)
+
+        self.clock.sleep(REDIS_RETRY_INTERVAL)
+        take_script.side_effect = None
+        take_script.return_value = b'0'
+        self.assertEqual(limiter.take(), 0)
+        self.assertEqual(take_script.call_count, 2)
+
+    def test_rate_limit_headers(self):
+        ceiling, wait = parse_rate_limit_headers(make_response(200, {
+            'X-RateLimit-Limit': '100', 'X-RateLimit-Interval-Milliseconds': '10000',
+            'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '5',
+        }))
+        self.assertEqual((ceiling, wait), (10, 5))
+
+        # A reset given as an epoch timestamp
+        ceiling, wait = parse_rate_limit_headers(make_response(200, {
+            'RateLimit-Remaining': '0', 'RateLimit-Reset': str(self.clock.now + 12),
+        }))
+        self.assertEqual((ceiling, wait), (None, 12))
+
+        self.assertEqual(parse_rate_limit_headers(make_response(200, {'X-RateLimit-Remaining': '3'})), (None, None))
+
+    def test_retry_after_seconds_and_dates(self):
+        in_30s = formatdate(self.clock.now + 30, usegmt=True)
+        an_hour_ago = formatdate(self.clock.now - 3600, usegmt=True)
+        self.assertEqual(get_retry_after(make_response(429, {'Retry-After': '7'})), 7)
+        self.assertEqual(get_retry_after(make_response(429, {'Retry-After': in_30s})), 30)
+        self.assertEqual(get_retry_after(make_response(429, {'Retry-After': an_hour_ago})), 0)
+        self.assertIsNone(get_retry_after(make_response(429, {'Retry-After': 'soon'})))
+        self.assertIsNone(get_retry_after(make_response(429)))
+        self.assertIsNone(get_retry_after(None))
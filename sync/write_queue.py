@@ -0,0 +1,149 @@
+import logging
+
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+
+def single_writer_enabled():
+    """Whether push workers hand their row updates to the single writer queue (SQLITE_SINGLE_WRITER)"""
+    return getattr(settings, 'SQLITE_SINGLE_WRITER', False)
+
+
+def get_writer_queue():
+    return getattr(settings, 'SQLITE_WRITER_QUEUE', 'sqlite-writer')
+
+
+class WriteBuffer:
+    """
+    Row updates collected by a push worker and committed together by the single writer.
+
+    Workers record what they would have saved (hl_id assignments, sync hashes, directory
+    entries, outbox and log updates) and flush at the end of a chunk, so the database lock is
+    taken and the journal synced once per batch instead of once per contact. Records created
+    in HighLevel are flushed right away: their hl_id exists nowhere else, and a worker dying
+    later in the chunk must not lose it.
+    Operations are applied in the order they were recorded.
+    """
+
+    def __init__(self):
+        self.operations = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def update(self, obj, fields):
+        """Save `fields` of a model instance, like obj.save(update_fields=fields)"""
+        self.operations.append({
+            'op': 'update',
+            'model': obj._meta.label,
+            'pk': obj.pk,
+            'fields': {field: getattr(obj, obj._meta.get_field(field).attname) for field in fields},
+        })
+
+    def increment(self, model, pk, amounts):
+        """Add `amounts` ({field: n}) to counters of a row, whatever their value is by then"""
+        self.operations.append({'op': 'increment', 'model': model._meta.label, 'pk': pk, 'amounts': dict(amounts)})
+
+    def record_highlevel_contacts(self, hl_contacts):
+        """Add HighLevel contacts ({'id', 'email'} dicts) to the directory"""
+        self.operations.append({'op': 'record_highlevel_contacts', 'hl_contacts': list(hl_contacts)})
+
+    def delete_highlevel_contact(self, hl_id):
+        """Remove a contact deleted in HighLevel from the directory"""
+        self.operations.append({'op': 'delete_highlevel_contact', 'hl_id': hl_id})
+
+    def mark_outbox_processed(self, contact_ids, drained_at):
+        """Mark outbox entries done unless their contact changed after `drained_at`"""
+        self.operations.append({
+            'op': 'mark_outbox_processed', 'contact_ids': list(contact_ids), 'drained_at': drained_at,
+        })
+
+    def flush(self):
+        """Hand the collected operations to the writer queue (or apply them here) and start over"""
+        operations, self.operations = self.operations, []
+        if not operations:
+            return
+        if single_writer_enabled():
+            apply_writes_task.apply_async(args=[operations], queue=get_writer_queue())
+        else:
+            apply_writes(operations)
+
+
+def _apply(operation):
+    # Imported here: highlevel_sync imports this module
+    from .highlevel_sync import record_highlevel_contacts
+    from .models import HighLevelOutbox, HLContact
+
+    kind = operation['op']
+    if kind == 'update':
+        model = apps.get_model(operation['model'])
+        model.objects.filter(pk=operation['pk']).update(**operation['fields'])
+    elif kind == 'increment':
+        model = apps.get_model(operation['model'])
+        model.objects.filter(pk=operation['pk']).update(
+            **{field: F(field) + amount for field, amount in operation['amounts'].items()}
+        )
+    elif kind == 'record_highlevel_contacts':
+        record_highlevel_contacts(operation['hl_contacts'])
+    elif kind == 'delete_highlevel_contact':
+        HLContact.objects.filter(hl_id=operation['hl_id']).delete()
+    elif kind == 'mark_outbox_processed':
+        drained_at = operation['drained_at']
+        HighLevelOutbox.objects.filter(
+            contact_id__in=operation['contact_ids'], processed_at__isnull=True,
+            created_at__lte=parse_datetime(drained_at) if isinstance(drained_at, str) else drained_at,
+        ).update(processed_at=timezone.now())
+    else:
+        raise ValueError(f"Unknown write operation: {kind}")
+
+
+def apply_writes(operations):
+    """
+    Apply a batch of operations in one transaction.
+    If the batch violates a constraint (e.g. an hl_id claimed by another contact meanwhile),
+    it is applied again one operation at a time so only the offending rows are dropped.
+    """
+    try:
+        with transaction.atomic():
+            for operation in operations:
+                _apply(operation)
+        return len(operations)
+    except IntegrityError as e:
+        logger.warning(f"Write batch of {len(operations)} operations failed, applying one at a time: {e}")
+
+    applied = 0
+    with transaction.atomic():
+        for operation in operations:
+            try:
+                with transaction.atomic():
+                    _apply(operation)
+                applied += 1
+            except IntegrityError as e:
+                logger.error(f"Dropped write {operation}: {e}")
+    return applied
+
+
+@shared_task(
+    name='sync.apply_writes_task',
+    # "database is locked" and the like: every operation can be applied again
+    autoretry_for=(OperationalError,),
+    retry_backoff=True,
+    retry_backoff_max=60,
+    max_retries=10,
+    acks_late=True,
+)
+def apply_writes_task(operations):
+    """
+    Single writer: commit a batch of row updates from a push worker.
+    Runs on the SQLITE_WRITER_QUEUE queue, served by one worker with concurrency 1.
+    A batch that fails with an OperationalError is retried with backoff (behind the batches
+    queued meanwhile), and one interrupted by the worker dying is delivered again.
+    """
+    return apply_writes(operations)